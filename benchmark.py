@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+## Benchmark
+Measures stamper cycle time on simulated hardware, storage operations per
+second, and web app latency and throughput under concurrent clients. Runs
+without hardware and writes results as JSON so runs can be compared.
+
+Dependencies: flask, flask-wtf, numpy, openpyxl
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from threading import Thread
+from typing import Any, Callable
+
+# Uses simulated hardware for every stamper import below
+os.environ["STAMPER_BACKEND"] = "sim"
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+# Random codes stand in for a typical floor run
+REPRESENTATIVE_CODES = 20
+SEED = 1
+# Codes with four distinct characters far apart on the wheel, among the
+# slowest to print either way
+WORST_CASE_CODES = ("1039", "219F", "E5C0", "084C")
+# Fraction a simulated result may get worse by before it counts as a
+# regression
+TOLERANCE = 0.25
+# Fraction a wall-clock result may get worse by, as real timings vary from
+# run to run and machine to machine
+WALL_CLOCK_TOLERANCE = 1.0
+
+
+def _summarize(samples: list[float]) -> dict[str, float]:
+    """
+    Returns mean, median, 95th percentile and maximum of samples.
+    """
+    ordered = sorted(samples)
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+def bench_cycles(codes: list[str], slow: bool = False) -> dict[str, Any]:
+    """
+    Prints codes one after another on simulated hardware. Returns simulated
+    seconds per code and real seconds spent planning and stepping them.
+    """
+    import simulator
+    import stamper
+
+    chassis = stamper.Chassis(stamper.STARTING_CHARACTER)
+    simulated, real = [], []
+    for code in codes:
+        start, real_start = simulator.clock.now, time.perf_counter()
+        if slow:
+            chassis.print_slow(code)
+        else:
+            chassis.print_fast(code)
+        simulated.append(simulator.clock.now - start)
+        real.append(time.perf_counter() - real_start)
+    return {
+        "codes": len(codes),
+        "cycle_seconds": _summarize(simulated),
+        "real_seconds": _summarize(real),
+    }
+
+
+def bench_storage(operations: int) -> dict[str, float]:
+    """
+    Times cell reads and writes. Returns operations per second for each.
+    """
+    import storage
+
+    store = storage.StateStore(flush_interval=3600)
+    store.set(storage.Cells.CODE, "0000")
+    results = {}
+    for name, operation in (
+        ("get_cell", lambda index: store.get(storage.Cells.CODE)),
+        ("set_cell", lambda index: store.set(storage.Cells.CODE, f"{index:04X}")),
+    ):
+        start = time.perf_counter()
+        for index in range(operations):
+            operation(index)
+        results[f"{name}_ops_per_second"] = operations / (time.perf_counter() - start)
+    store.flush()
+    return results
+
+
+def _load(clients: int, requests: int, send: Callable[[Any, int], Any]) -> dict:
+    """
+    Sends requests from several clients at once. Returns latency summary in
+    milliseconds and requests per second.
+    """
+    import webapp
+
+    latencies: list[float] = []
+
+    def client() -> None:
+        test_client = webapp.app.test_client()
+        for index in range(requests):
+            start = time.perf_counter()
+            send(test_client, index)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "latency_ms": _summarize(latencies),
+        "requests_per_second": len(latencies) / elapsed,
+    }
+
+
+def bench_webapp(clients: int, requests: int) -> dict[str, Any]:
+    """
+    Loads home page with GET and code submissions with POST. Returns latency
+    and throughput of each.
+    """
+    import webapp
+
+    # Form posts from a test client carry no CSRF token
+    webapp.app.config["WTF_CSRF_ENABLED"] = False
+    return {
+        "home_get": _load(clients, requests, lambda client, _: client.get("/")),
+        "home_post": _load(
+            clients,
+            requests,
+            lambda client, index: client.post("/", data={"code": f"{index:04X}"}),
+        ),
+    }
+
+
+def run(quick: bool = False) -> dict[str, Any]:
+    """
+    Runs every benchmark. Optional quick parameter runs fewer iterations.
+    Returns results.
+    """
+    scale = 0.2 if quick else 1
+    generator = random.Random(SEED)
+    representative = [
+        f"{generator.randrange(1 << 16):04X}"
+        for _ in range(max(int(REPRESENTATIVE_CODES * scale), 1))
+    ]
+    return {
+        "cycle": {
+            "fast_representative": bench_cycles(representative),
+            "fast_worst_case": bench_cycles(list(WORST_CASE_CODES)),
+            "slow_representative": bench_cycles(representative, slow=True),
+            "slow_worst_case": bench_cycles(list(WORST_CASE_CODES), slow=True),
+        },
+        "storage": bench_storage(int(100_000 * scale)),
+        "webapp": bench_webapp(clients=8, requests=int(50 * scale)),
+    }
+
+
+def _flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    """
+    Flattens nested results into dotted names.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(
+    current: dict,
+    previous: dict,
+    tolerance: float = TOLERANCE,
+    wall_tolerance: float = WALL_CLOCK_TOLERANCE,
+) -> list[str]:
+    """
+    Compares results with a previous run. Simulated cycle times repeat exactly
+    and are compared with tolerance. Wall-clock results are compared only by
+    their means and rates, with wider wall-clock tolerance. Rates should rise
+    and times fall. Returns description of each result that got worse by more
+    than its tolerance. Raises error if only one run is quick.
+    """
+    if current.get("quick") != previous.get("quick"):
+        raise ValueError("Cannot compare a quick run with a full one!")
+    now, before = _flatten(current["results"]), _flatten(previous["results"])
+    regressions = []
+    for name, value in now.items():
+        old = before.get(name)
+        if not old or name.endswith(".codes"):
+            continue
+        if ".cycle_seconds." in name:
+            allowed = tolerance
+        # Skips percentiles of wall-clock timings, which are too noisy
+        elif name.endswith((".mean", "per_second")):
+            allowed = wall_tolerance
+        else:
+            continue
+        higher_is_better = name.endswith("per_second")
+        change = (value - old) / old * (1 if higher_is_better else -1)
+        if change < -allowed:
+            regressions.append(f"{name}: {old:.4g} -> {value:.4g}")
+    return regressions
+
+
+def main() -> None:
+    """
+    Runs benchmarks and prints results as JSON. Optionally writes them to a
+    file and compares them with a previous run, exiting with an error if any
+    result regressed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--output", help="file to write results to")
+    parser.add_argument("--compare", help="previous results to compare with")
+    parser.add_argument("--quick", action="store_true", help="run fewer iterations")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="fraction a simulated result may get worse by",
+    )
+    parser.add_argument(
+        "--wall-tolerance",
+        type=float,
+        default=WALL_CLOCK_TOLERANCE,
+        help="fraction a wall-clock mean or rate may get worse by",
+    )
+    arguments = parser.parse_args()
+    # Keeps database and sheet away from real ones, and progress output quiet
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = run(arguments.quick)
+        finally:
+            os.chdir(directory)
+    report = {
+        "version": __version__,
+        "time": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "quick": arguments.quick,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(text)
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            previous = json.load(file)
+        try:
+            regressions = compare(
+                report, previous, arguments.tolerance, arguments.wall_tolerance
+            )
+        except ValueError as error:
+            sys.exit(str(error))
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
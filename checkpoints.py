@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+## Checkpoints
+Journals every character the motion controller inks and prints, so a job
+interrupted by a crash or power loss resumes at its next unprinted character
+instead of starting over. Each checkpoint is one fixed width record appended
+to the journal and synced to disk. Records carry a checksum, so a record torn
+by power loss is dropped when the journal is next opened. The journal is
+emptied once no job is left unfinished and it has grown large.
+
+Print a journal with:
+$ python checkpoints.py [file]
+"""
+
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import NamedTuple, Optional
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+JOURNAL = "stamper.journal"
+# Time, job, kind, code position, wheel character, wheel position in half
+# steps, and horizontal and vertical positions of every record
+BODY = struct.Struct("<dIBBcHff")
+CHECKSUM = struct.Struct("<I")
+RECORD_SIZE = BODY.size + CHECKSUM.size
+MAGIC = b"STMPJRN1"
+# Position of inking records, which are not at a position of the code
+NO_POSITION = 0xFF
+# Bytes journal may grow to before it is emptied
+COMPACT_BYTES = 64 * 1024
+
+
+class Kinds:
+    """
+    Establishes kinds of checkpoint.
+    """
+
+    INKED = 0
+    PRINTED = 1
+    DONE = 2
+
+
+class Checkpoint(NamedTuple):
+    """
+    A character inked or printed, or a job finished, and where chassis was
+    afterwards.
+    """
+
+    time: float
+    job: int
+    kind: int
+    position: int
+    character: str
+    wheel_position: int
+    horizontal: float
+    vertical: float
+
+
+class Journal:
+    """
+    Appends checkpoints to journal file, and keeps positions printed of every
+    job not yet finished.
+    """
+
+    def __init__(self, filename: str = JOURNAL, sync: bool = True) -> None:
+        """
+        Opens journal, reading checkpoints of unfinished jobs and dropping any
+        torn record at the end. Optional file name and parameter to sync each
+        checkpoint to disk.
+        """
+        self.filename = filename
+        self.sync = sync
+        # Positions printed by each unfinished job
+        self._printed: dict[int, set[int]] = {}
+        # Latest checkpoint of a character inked or printed
+        self.last: Optional[Checkpoint] = None
+        # Job that checkpoints are for
+        self.job: Optional[int] = None
+        valid = self._read()
+        self._fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.ftruncate(self._fd, valid)
+        if not valid:
+            self._write(MAGIC)
+
+    def _read(self) -> int:
+        """
+        Replays checkpoints in journal. Returns length of journal up to end of
+        last whole record, or 0 if there is no journal.
+        """
+        try:
+            with open(self.filename, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return 0
+        if not data.startswith(MAGIC):
+            print(f"{self.filename} is not a checkpoint journal, starting again")
+            return 0
+        checkpoints, length = _parse(data)
+        for checkpoint in checkpoints:
+            self._replay(checkpoint)
+        return length
+
+    def _replay(self, checkpoint: Checkpoint) -> None:
+        """
+        Applies checkpoint to positions printed by each unfinished job.
+        """
+        if checkpoint.kind == Kinds.DONE:
+            self._printed.pop(checkpoint.job, None)
+            return
+        printed = self._printed.setdefault(checkpoint.job, set())
+        if checkpoint.kind == Kinds.PRINTED:
+            printed.add(checkpoint.position)
+        self.last = checkpoint
+
+    def _write(self, data: bytes) -> None:
+        os.write(self._fd, data)
+        if self.sync:
+            os.fsync(self._fd)
+
+    def begin(self, job_id: Optional[int]) -> None:
+        """
+        Sets job that following checkpoints are for, or None for no job.
+        """
+        self.job = job_id
+
+    def record(
+        self,
+        kind: int,
+        character: str,
+        position: int,
+        wheel_position: int,
+        horizontal: float,
+        vertical: float,
+    ) -> None:
+        """
+        Appends checkpoint for current job, if there is one. Takes kind,
+        character, position in code, and wheel, horizontal and vertical
+        positions of chassis as parameters.
+        """
+        if self.job is not None:
+            self._append(
+                Checkpoint(
+                    time.time(),
+                    self.job,
+                    kind,
+                    position,
+                    character,
+                    wheel_position,
+                    horizontal,
+                    vertical,
+                )
+            )
+
+    def finish(self, job_id: int) -> None:
+        """
+        Marks job finished, so it is never resumed. Empties journal if it is
+        large and no job is left unfinished.
+        """
+        if job_id not in self._printed:
+            return
+        self._append(Checkpoint(time.time(), job_id, Kinds.DONE, 0, "-", 0, 0.0, 0.0))
+        if not self._printed and os.fstat(self._fd).st_size >= COMPACT_BYTES:
+            os.ftruncate(self._fd, len(MAGIC))
+            os.fsync(self._fd)
+            self.last = None
+
+    def _append(self, checkpoint: Checkpoint) -> None:
+        body = BODY.pack(
+            checkpoint.time,
+            checkpoint.job,
+            checkpoint.kind,
+            checkpoint.position,
+            checkpoint.character.encode(),
+            checkpoint.wheel_position,
+            checkpoint.horizontal,
+            checkpoint.vertical,
+        )
+        self._write(body + CHECKSUM.pack(zlib.crc32(body)))
+        self._replay(checkpoint)
+
+    def printed(self, job_id: int) -> frozenset[int]:
+        """
+        Returns positions of code already printed by unfinished job.
+        """
+        return frozenset(self._printed.get(job_id, ()))
+
+    def unfinished(self) -> list[int]:
+        """
+        Returns IDs of jobs that were checkpointed but never finished.
+        """
+        return sorted(self._printed)
+
+    def close(self) -> None:
+        """
+        Closes journal file.
+        """
+        os.close(self._fd)
+
+
+def _parse(data: bytes) -> tuple[list[Checkpoint], int]:
+    """
+    Unpacks records of journal, stopping at any record torn by power loss.
+    Returns checkpoints and length of journal up to end of last whole record.
+    """
+    checkpoints = []
+    offset = len(MAGIC)
+    while offset + RECORD_SIZE <= len(data):
+        body = data[offset : offset + BODY.size]
+        if zlib.crc32(body) != CHECKSUM.unpack_from(data, offset + BODY.size)[0]:
+            break
+        fields = list(BODY.unpack(body))
+        fields[4] = fields[4].decode()
+        checkpoints.append(Checkpoint(*fields))
+        offset += RECORD_SIZE
+    return checkpoints, offset
+
+
+def read(filename: str = JOURNAL) -> list[Checkpoint]:
+    """
+    Returns every whole checkpoint in journal, in order written. Raises
+    ValueError if file is not a journal.
+    """
+    with open(filename, "rb") as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{filename} is not a checkpoint journal!")
+    return _parse(data)[0]
+
+
+def main() -> None:
+    """
+    Prints checkpoints of journal given on command line, or default journal.
+    """
+    kinds = {Kinds.INKED: "inked", Kinds.PRINTED: "printed", Kinds.DONE: "done"}
+    for checkpoint in read(sys.argv[1] if len(sys.argv) > 1 else JOURNAL):
+        line = (
+            f"{time.strftime('%H:%M:%S', time.localtime(checkpoint.time))} "
+            f"#{checkpoint.job} {kinds[checkpoint.kind]}"
+        )
+        if checkpoint.kind != Kinds.DONE:
+            line += f" {checkpoint.character}"
+            if checkpoint.position != NO_POSITION:
+                line += f" at {checkpoint.position}"
+            line += (
+                f" wheel={checkpoint.wheel_position}"
+                f" horizontal={checkpoint.horizontal:.1f}"
+                f" vertical={checkpoint.vertical:.1f}"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+"""
+## Estimator
+Estimates how long each code takes to print, from the plans the chassis
+actually runs. Estimates for every code are built once into a lookup table
+cached on disk, and give queue and job ETAs without importing stamper.
+Queues are timed in batches as the controller prints them. The controller
+refines ETAs by compiling the plans of each batch in a separate process.
+
+Dependencies: numpy
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Any, Optional, Sequence
+
+import numpy as np
+
+import geometry
+from geometry import CHARACTERS, CODE_LENGTH, STARTING_CHARACTER
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+CACHE = "estimates.npz"
+MODES = ("fast", "slow")
+# Seconds to ink each code on its own, and to print it once inked
+COLUMNS = MODES + ("ink", "print")
+# Mode timing queue as batches printed by Chassis.print_batch()
+BATCH = "batch"
+# Most queued codes the controller times from compiled plans
+REFINE_LIMIT = 512
+# Characters inked by each sample pass when fitting inking time
+INK_SAMPLES = tuple(range(1, len(CHARACTERS) + 1)) * 8
+# Every code of four wheel characters
+NUM_CODES = len(CHARACTERS) ** CODE_LENGTH
+# Sources whose changes make cached estimates out of date
+SOURCES = ("stamper.py", "geometry.py", "estimator.py")
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Maps each byte to its wheel index
+_LOOKUP = np.zeros(256, np.int64)
+for _index, _character in enumerate(CHARACTERS):
+    _LOOKUP[ord(_character)] = _LOOKUP[ord(_character.lower())] = _index
+# Place value of each character of a code
+_PLACES = len(CHARACTERS) ** np.arange(CODE_LENGTH - 1, -1, -1)
+
+# Loaded table and modification time of its file
+_table: Optional[dict[str, np.ndarray]] = None
+_loaded_mtime = 0.0
+# Steady start states for each mode, worked out once per building process
+_starts: dict[str, Any] = {}
+
+
+def source_key() -> str:
+    """
+    Returns hash of source files that estimates are built from.
+    """
+    digest = hashlib.sha1()
+    for name in SOURCES:
+        with open(os.path.join(DIRECTORY, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _steady_starts() -> dict[str, Any]:
+    """
+    Returns chassis state at start of a code printed right after another in
+    each mode, with wheel on starting character.
+    """
+    import stamper
+
+    zeroed = stamper.ChassisState(STARTING_CHARACTER, 0, 0.0, 0.0)
+    starts = {}
+    for mode, action in (("fast", "print"), ("slow", "slow")):
+        end = stamper.compile_plan(action, STARTING_CHARACTER * CODE_LENGTH, zeroed)
+        starts[mode] = zeroed._replace(
+            horizontal=end.end_states[-1].horizontal,
+            vertical=end.end_states[-1].vertical,
+        )
+    return starts
+
+
+def _code_seconds(value: int) -> tuple[float, float, float, float]:
+    """
+    Compiles plans for code of specified index from steady start states.
+    Returns seconds to print it fast and slow, to ink it, and to print it
+    once inked.
+    """
+    import stamper
+
+    if not _starts:
+        _starts.update(_steady_starts())
+    code = "".join(
+        CHARACTERS[value // place % len(CHARACTERS)] for place in _PLACES.tolist()
+    )
+    ink = stamper.compile_plan("ink", code, _starts["fast"])
+    printing = stamper.compile_plan("print", code, ink.end_states[-1])
+    slow = stamper.compile_plan("slow", code, _starts["slow"])
+    return (
+        ink.seconds() + printing.seconds(),
+        slow.seconds(),
+        ink.seconds(),
+        printing.seconds(),
+    )
+
+
+def _fit_batches() -> tuple[float, float, float]:
+    """
+    Compiles inking passes for random sets of characters from random wheel
+    positions, and prints of random codes right after inking and right after
+    another print. Returns seconds per character inked and seconds per pass
+    of a straight line fitted to passes, as a pass costs about the same for
+    each character it inks, and mean seconds saved by printing a code right
+    after another instead of after inking.
+    """
+    import random
+
+    import stamper
+
+    if not _starts:
+        _starts.update(_steady_starts())
+    generator = random.Random(0)
+    seconds = []
+    saved = []
+    for count in INK_SAMPLES:
+        start = generator.choice(CHARACTERS)
+        state = _starts["fast"]._replace(
+            character=start,
+            wheel=geometry.index_of(start) * stamper.Chassis.CHARACTER_HALF_STEPS,
+        )
+        characters = "".join(generator.sample(CHARACTERS, count))
+        ink = stamper.compile_plan("ink", characters, state)
+        seconds.append(ink.seconds())
+        # Prints a code from where inking left wheel, and from last print
+        inked = ink.end_states[-1]
+        code = "".join(generator.choices(CHARACTERS, k=CODE_LENGTH))
+        after_ink = stamper.compile_plan("print", code, inked)
+        after_print = stamper.compile_plan(
+            "print",
+            code,
+            _starts["fast"]._replace(character=inked.character, wheel=inked.wheel),
+        )
+        saved.append(after_ink.seconds() - after_print.seconds())
+    slope, intercept = np.polyfit(INK_SAMPLES, seconds, 1)
+    return float(slope), float(intercept), float(np.mean(saved))
+
+
+def _batch_limits() -> tuple[int, float, int]:
+    """
+    Returns codes taken per batch, and limits on ink age and stamps, that
+    the controller prints with.
+    """
+    import stamper
+
+    return (
+        stamper.Chassis.BATCH_SIZE,
+        stamper.Chassis.INK_MAX_AGE,
+        stamper.Chassis.INK_MAX_STAMPS,
+    )
+
+
+def build(filename: str = CACHE, processes: Optional[int] = None) -> None:
+    """
+    Estimates every code in both modes with wheel starting on the starting
+    character and saves table. Other starting characters are looked up by
+    turning codes by the same amount. Also saves a fit of inking and
+    printing times in batches, and the batch limits, for timing queues in
+    batches.
+    Optional number of processes parameter.
+    """
+    with Pool(processes) as pool:
+        seconds = np.array(
+            pool.map(_code_seconds, range(NUM_CODES), chunksize=256), np.float32
+        )
+    # Writes whole file before replacing old one
+    temporary = f"{filename}.tmp.npz"
+    np.savez(
+        temporary,
+        **{column: seconds[:, index] for index, column in enumerate(COLUMNS)},
+        batch_fit=np.array(_fit_batches()),
+        limits=np.array(_batch_limits(), np.float64),
+        key=source_key(),
+    )
+    os.replace(temporary, filename)
+
+
+def is_current(filename: str = CACHE) -> bool:
+    """
+    Checks whether saved table was built from current sources.
+    """
+    try:
+        with np.load(filename) as saved:
+            return str(saved["key"]) == source_key()
+    except (OSError, KeyError, ValueError):
+        return False
+
+
+def _builder(filename: str) -> Optional[int]:
+    """
+    Returns ID of process building table, if one holds the lock file and is
+    still running.
+    """
+    try:
+        with open(f"{filename}.lock") as file:
+            pid = int(file.read())
+        # Checks process exists without signalling it
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    return pid
+
+
+def _lock(filename: str) -> bool:
+    """
+    Takes lock file for building table, replacing one left by a process that
+    is no longer running. Returns whether lock was taken.
+    """
+    for _ in range(2):
+        try:
+            descriptor = os.open(
+                f"{filename}.lock", os.O_CREAT | os.O_EXCL | os.O_WRONLY
+            )
+        except FileExistsError:
+            if _builder(filename) is not None:
+                return False
+            # Removes stale lock and tries again
+            try:
+                os.unlink(f"{filename}.lock")
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(descriptor, "w") as file:
+            file.write(str(os.getpid()))
+        return True
+    return False
+
+
+def build_in_background(filename: str = CACHE) -> Optional[subprocess.Popen]:
+    """
+    Builds table in a separate low priority process if saved one is missing
+    or out of date and no other process is building it, such as one started
+    by a controller before it was restarted. Returns process, if started.
+    """
+    if is_current(filename) or _builder(filename) is not None:
+        return None
+    print("Building cycle time estimates in background. . .")
+    return subprocess.Popen(
+        ["nice", "-n", "19", sys.executable, __file__, "--build", filename],
+        env=dict(os.environ, STAMPER_BACKEND="sim"),
+    )
+
+
+def load(filename: str = CACHE) -> Optional[dict[str, np.ndarray]]:
+    """
+    Returns table of seconds for each code by column, with batch fit and
+    limits, reloading it if file changed. Returns None if no table has
+    been built.
+    """
+    global _table, _loaded_mtime
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        return None
+    if _table is None or mtime != _loaded_mtime:
+        with np.load(filename) as saved:
+            _table = {name: saved[name] for name in COLUMNS + ("batch_fit", "limits")}
+        _loaded_mtime = mtime
+    return _table
+
+
+@lru_cache(maxsize=256)
+def _batch_seconds(codes: tuple[str, ...], start: Any) -> tuple[list[float], Any]:
+    """
+    Compiles and times plans Chassis.print_batch() runs for one batch of codes
+    from start state, re-inking whenever ink of next code is missing, too old
+    or too used. Returns seconds until each code is printed, and state chassis
+    is left in.
+    """
+    import stamper
+
+    elapsed = 0.0
+    state = start
+    # When each character was inked and stamps made since
+    inked_at: dict[str, float] = {}
+    stamps: dict[str, int] = {}
+    finished = []
+    for index, code in enumerate(codes):
+        stale = any(
+            character not in inked_at
+            or elapsed - inked_at[character] > stamper.Chassis.INK_MAX_AGE
+            or stamps[character] + code.count(character)
+            > stamper.Chassis.INK_MAX_STAMPS
+            for character in set(code) - {stamper.Chassis.GAP}
+        )
+        if stale:
+            upcoming = codes[index : index + stamper.Chassis.BATCH_SIZE]
+            count, _ = stamper.ink_window(
+                upcoming,
+                state,
+                stamper.Chassis.INK_MAX_AGE,
+                stamper.Chassis.INK_MAX_STAMPS,
+            )
+            upcoming = "".join(upcoming[:count])
+            ink = stamper.compile_plan("ink", upcoming, state)
+            inked_at = dict.fromkeys(upcoming, elapsed)
+            stamps = dict.fromkeys(upcoming, 0)
+            elapsed += ink.seconds()
+            state = ink.end_states[-1]
+        printing = stamper.compile_plan("print", code, state)
+        elapsed += printing.seconds()
+        state = printing.end_states[-1]
+        for character in code.replace(stamper.Chassis.GAP, ""):
+            stamps[character] += 1
+        finished.append(elapsed)
+    return finished, state
+
+
+def plan_queue_eta(codes: Sequence[str], start: str) -> np.ndarray:
+    """
+    Estimates seconds until each code of a queue is printed from the plans
+    the controller compiles, taking queue in batches as it does. Takes codes
+    and starting character as parameters. Costs a few milliseconds a code
+    the first time a batch is seen, so is only run by Refiner.
+    """
+    import stamper
+
+    codes = [code.upper() for code in codes]
+    if not _starts:
+        _starts.update(_steady_starts())
+    state = _starts["fast"]._replace(
+        character=start,
+        wheel=geometry.index_of(start) * stamper.Chassis.CHARACTER_HALF_STEPS,
+    )
+    seconds: list[float] = []
+    for index in range(0, len(codes), stamper.Chassis.BATCH_SIZE):
+        batch = tuple(codes[index : index + stamper.Chassis.BATCH_SIZE])
+        finished, state = _batch_seconds(batch, state)
+        offset = seconds[-1] if seconds else 0.0
+        seconds.extend(offset + elapsed for elapsed in finished)
+    return np.array(seconds)
+
+
+def _batch_eta(
+    table: dict[str, np.ndarray], indices: np.ndarray, rows: np.ndarray
+) -> np.ndarray:
+    """
+    Estimates seconds until each code of a queue is printed in batches from
+    table. Takes wheel indices of each code's characters and table rows of
+    codes as parameters. Each batch is split into runs of codes inked for in
+    one pass, ending where ink would get too old or too used, as
+    ink_window() does. Each pass is timed from the characters it inks, and
+    codes after the first of a pass print from the floor instead of the ink.
+    """
+    batch_size, max_ink_age, max_ink_stamps = table["limits"]
+    batch_size = int(batch_size)
+    slope, intercept, saved = table["batch_fit"]
+    count = len(rows)
+    # Lays queue out as a batch per row, padding last one
+    batches = -(-count // batch_size)
+    printing = np.zeros(batches * batch_size)
+    printing[:count] = table["print"][rows] - saved
+    printing = printing.reshape(batches, batch_size)
+    valid = (np.arange(batches * batch_size) < count).reshape(batches, batch_size)
+    # Stamps each code makes with each character
+    stamps = np.zeros((batches * batch_size, len(CHARACTERS)), np.int64)
+    np.add.at(stamps, (np.arange(count).repeat(CODE_LENGTH), indices.ravel()), 1)
+    stamps = stamps.reshape(batches, batch_size, len(CHARACTERS))
+    # Finds codes inked for and inking seconds of a pass from each position
+    window = np.ones((batches, batch_size), np.int64)
+    inking = np.zeros((batches, batch_size))
+    every = np.arange(batches)
+    for first in range(batch_size):
+        used = np.cumsum(stamps[:, first:], axis=1)
+        ink = intercept + slope * (used > 0).sum(axis=2)
+        seconds = ink + saved + np.cumsum(printing[:, first:], axis=1)
+        fits = (
+            valid[:, first:]
+            & (used.max(axis=2) <= max_ink_stamps)
+            & (seconds <= max_ink_age)
+        )
+        # First code is always inked for
+        fits[:, 0] = True
+        window[:, first] = np.cumprod(fits, axis=1).sum(axis=1)
+        inking[:, first] = ink[every, window[:, first] - 1]
+    # Follows passes through every batch at once, charging each to its first
+    # code, which prints from the ink
+    seconds = printing.copy()
+    position = np.zeros(batches, np.int64)
+    for _ in range(batch_size):
+        inside = np.minimum(position, batch_size - 1)
+        live = (position < batch_size) & valid[every, inside]
+        seconds[every[live], position[live]] += (
+            inking[every[live], position[live]] + saved
+        )
+        position[live] += window[every[live], position[live]]
+    return np.cumsum(seconds.ravel()[:count])
+
+
+def queue_eta(
+    codes: Sequence[str], mode: str = BATCH, start: str = STARTING_CHARACTER
+) -> Optional[np.ndarray]:
+    """
+    Estimates seconds until each code of a queue is printed, with each code
+    starting where the wheel stopped after the one before. Batch mode shares
+    inking between the codes of each batch as the controller does. Returns
+    None if no table has been built or a code is not the usual length.
+    """
+    if any(len(code) != CODE_LENGTH for code in codes):
+        return None
+    if not codes:
+        return np.zeros(0)
+    table = load()
+    if table is None:
+        return None
+    raw = np.frombuffer("".join(codes).encode("ascii"), np.uint8)
+    indices = _LOOKUP[raw].reshape(len(codes), CODE_LENGTH)
+    # Wheel starts each code on last character of code before
+    starts = np.concatenate(([geometry.index_of(start)], indices[:-1, -1]))
+    # Turns codes so each starts from the starting character
+    turned = (indices - starts[:, None]) % len(CHARACTERS)
+    if mode == BATCH:
+        return _batch_eta(table, indices, turned @ _PLACES)
+    return np.cumsum(table[mode][turned @ _PLACES].astype(np.float64))
+
+
+def estimate(
+    code: str, mode: str = "fast", start: str = STARTING_CHARACTER
+) -> Optional[float]:
+    """
+    Estimates seconds to print code from starting character. A code printed
+    on its own is inked separately, so fast mode matches a batch of one.
+    Returns None if no table has been built.
+    """
+    eta = queue_eta([code.upper()], mode, start)
+    return None if eta is None else float(eta[0])
+
+
+class Refiner:
+    """
+    Times queues from compiled plans in a separate low priority process, so
+    compiling never competes with step timing for the controller's
+    interpreter.
+    """
+
+    def __init__(self) -> None:
+        """
+        Times queues from compiled plans in a separate process, started on
+        first use.
+        """
+        self._process: Optional[subprocess.Popen] = None
+
+    def queue_eta(self, codes: Sequence[str], start: str) -> list[float]:
+        """
+        Estimates seconds until each code of a queue is printed with
+        plan_queue_eta(). Takes codes and starting character as parameters.
+        Starts process again if it exited. Raises OSError if process stops
+        answering.
+        """
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                ["nice", "-n", "19", sys.executable, __file__, "--refine"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                env=dict(os.environ, STAMPER_BACKEND="sim"),
+            )
+        assert self._process.stdin and self._process.stdout
+        request = {"codes": list(codes), "start": start}
+        self._process.stdin.write(json.dumps(request) + "\n")
+        self._process.stdin.flush()
+        reply = self._process.stdout.readline()
+        if not reply:
+            raise OSError("Refining process exited.")
+        return json.loads(reply)
+
+    def close(self) -> None:
+        """
+        Stops process.
+        """
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+
+if __name__ == "__main__":
+    if "--refine" in sys.argv:
+        # Answers each queue sent by Refiner until controller closes pipe
+        for line in sys.stdin:
+            request = json.loads(line)
+            eta = plan_queue_eta(request["codes"], request["start"])
+            print(json.dumps(eta.tolist()), flush=True)
+    elif "--build" in sys.argv:
+        # Plans are only compiled, so simulated hardware is enough
+        os.environ.setdefault("STAMPER_BACKEND", "sim")
+        arguments = [arg for arg in sys.argv[1:] if arg != "--build"]
+        filename = arguments[0] if arguments else CACHE
+        # Leaves table to a build already running
+        if not _lock(filename):
+            print("Cycle time estimates already being built.")
+            sys.exit()
+        try:
+            build(filename)
+        finally:
+            os.unlink(f"{filename}.lock")
+        print("Cycle time estimates built.")
+    else:
+        for code in sys.argv[1:]:
+            print(code, {mode: estimate(code, mode) for mode in MODES})
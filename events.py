@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+## Events
+Publishes job progress events from one publisher to any number of
+listeners. Listeners wait on a shared condition instead of polling, and
+read recent events from a short history, so a slow listener never holds up
+the publisher.
+"""
+
+from collections import deque
+from threading import Condition
+from typing import Any, Iterator, Optional
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+# Events kept for listeners that fall behind or reconnect
+HISTORY = 256
+# Seconds a listener waits for an event before being told nothing happened
+HEARTBEAT = 15.0
+
+
+class Broadcaster:
+    """
+    Numbers published events, keeps recent ones, and wakes every listener
+    when one is published. Keeps latest value of every event field as
+    current state.
+    """
+
+    def __init__(self, history: int = HISTORY) -> None:
+        """
+        Starts with no events. Optional number of events to keep parameter.
+        """
+        self._events: deque[tuple[int, dict[str, Any]]] = deque(maxlen=history)
+        self._number = 0
+        self._published = Condition()
+        self.state: dict[str, Any] = {}
+
+    def publish(self, kind: str, **fields: Any) -> int:
+        """
+        Publishes event. Takes kind of event and its fields as parameters.
+        Returns event number.
+        """
+        with self._published:
+            self._number += 1
+            self._events.append((self._number, {"type": kind, **fields}))
+            self.state.update(fields)
+            self._published.notify_all()
+            return self._number
+
+    def snapshot(self) -> tuple[int, dict[str, Any]]:
+        """
+        Returns number of latest event and copy of current state.
+        """
+        with self._published:
+            return self._number, dict(self.state)
+
+    def listen(
+        self, after: Optional[int] = None, heartbeat: float = HEARTBEAT
+    ) -> Iterator[Optional[tuple[int, dict[str, Any]]]]:
+        """
+        Yields number and event of each event published after specified
+        number, or after now if none is given, in order. Yields None when no
+        event is published for heartbeat seconds. Events no longer in history
+        are skipped.
+        """
+        with self._published:
+            # Numbers ahead of publisher come from before it restarted
+            last = self._number if after is None else min(after, self._number)
+        while True:
+            with self._published:
+                self._published.wait_for(lambda: self._number > last, heartbeat)
+                new = [
+                    (number, event) for number, event in self._events if number > last
+                ]
+            if not new:
+                yield None
+                continue
+            yield from new
+            last = new[-1][0]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+## Geometry
+Stamper distances, speeds and wheel characters shared by the motion
+controller, web app and planning tools. Imports no hardware libraries.
+"""
+
+from math import copysign
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+STARTING_CHARACTER = "0"
+CHARACTERS = "0123456789ABCDEF"
+NUM_CHARACTERS = len(CHARACTERS)
+# Characters in every code
+CODE_LENGTH = 4
+# Codes taken from queue and inked for together
+BATCH_SIZE = 8
+STEPS_PER_REVOLUTION = 200
+# Default speeds for chassis movement and wheel
+MOVE_RPM = 80.0
+WHEEL_RPM = 20.0
+
+
+class NumSteps:
+    """
+    A class used by the chassis to measure distances and angles.
+    """
+
+    # Heights for vertical movement
+    FLOOR_POSITION = 2552.0
+    INK_POSITION = 2192.0
+    SURFACE_MARGIN = 200.0
+    # Counts for horizontal movement
+    INK_WIDTH = 1100.0
+    CHARACTER_WIDTH = 400.0
+    # Count for character advancement
+    ADVANCE_CHARACTER = 12.5
+    # Maximum positions
+    HORIZONTAL_MAX = 2300.0
+    VERTICAL_MAX = FLOOR_POSITION
+    # Distance above a surface within which stamp counts as touching it
+    CONTACT_CLEARANCE = 50.0
+
+
+def index_of(character: str) -> int:
+    """
+    Finds index of character on wheel.
+    """
+    # Checks for invalid character
+    if character.upper() not in CHARACTERS:
+        raise ValueError(f"Charater [ {character} ] not on wheel!")
+    # Returns appropriate index
+    return CHARACTERS.index(character.upper())
+
+
+def distance(old_character: str, new_character: str) -> int:
+    """
+    Finds signed number of stages between two characters on wheel, taking the
+    shorter way around.
+    """
+    # Finds distance between positions
+    character_distance = index_of(new_character) - index_of(old_character)
+    # Corrects for large distances
+    if abs(character_distance) > NUM_CHARACTERS // 2:
+        character_distance -= int(copysign(NUM_CHARACTERS, character_distance))
+    return character_distance
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+## IPC
+Local socket channel between the web process and the motion controller
+process. Each request and reply is one line of JSON. Operations whose
+handlers return a generator stream one reply per item.
+"""
+
+import json
+import os
+import socket
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Thread
+from types import GeneratorType
+from typing import Any, Callable, Iterator, Optional
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+SOCKET_PATH = "stamper.sock"
+# Seconds to wait for controller to reply
+TIMEOUT = 2.0
+
+
+class ControllerServer:
+    """
+    Answers requests from other processes on a Unix socket. Each request
+    names an operation that is passed to its handler.
+    """
+
+    def __init__(
+        self,
+        handlers: dict[str, Callable[[dict], Any]],
+        path: str = SOCKET_PATH,
+    ) -> None:
+        """
+        Answers requests on a Unix socket. Takes handlers for each operation
+        as parameter. Optional socket path parameter.
+        """
+        self.handlers = handlers
+        self.path = path
+        self._server: Optional[ThreadingUnixStreamServer] = None
+
+    def start(self) -> None:
+        """
+        Starts answering requests in a background thread.
+        """
+        # Removes socket left behind by a previous controller
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        handlers = self.handlers
+
+        class Handler(StreamRequestHandler):
+            def handle(self) -> None:
+                # Answers each line sent until client disconnects
+                for line in self.rfile:
+                    for reply in _dispatch(handlers, line):
+                        self.wfile.write(reply + b"\n")
+                        self.wfile.flush()
+
+        self._server = ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Stops answering requests and removes socket.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _dispatch(
+    handlers: dict[str, Callable[[dict], Any]], line: bytes
+) -> Iterator[bytes]:
+    """
+    Runs handler for request line. Yields encoded reply, or a reply for each
+    item if handler returns a generator.
+    """
+    try:
+        message = json.loads(line)
+        handler = handlers[message["op"]]
+        result = handler(message)
+        if isinstance(result, GeneratorType):
+            for item in result:
+                yield json.dumps({"ok": True, "result": item}).encode()
+            return
+        reply = {"ok": True, "result": result}
+    except Exception as error:
+        reply = {"ok": False, "error": repr(error)}
+    yield json.dumps(reply).encode()
+
+
+def request(op: str, path: str = SOCKET_PATH, **arguments: Any) -> Any:
+    """
+    Sends request for operation to controller and waits for reply. Takes
+    operation name and its arguments as parameters. Returns result. Raises
+    OSError if controller is not running and RuntimeError if request failed.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(TIMEOUT)
+        connection.connect(path)
+        connection.sendall(json.dumps({"op": op, **arguments}).encode() + b"\n")
+        reply = json.loads(connection.makefile("rb").readline())
+    if not reply["ok"]:
+        raise RuntimeError(reply["error"])
+    return reply["result"]
+
+
+def subscribe(op: str, path: str = SOCKET_PATH, **arguments: Any) -> Iterator[Any]:
+    """
+    Sends request for streamed operation to controller and yields each result
+    as it arrives, until controller closes stream. Raises OSError if
+    controller is not running or goes away and RuntimeError if request failed.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(TIMEOUT)
+        connection.connect(path)
+        connection.sendall(json.dumps({"op": op, **arguments}).encode() + b"\n")
+        # Waits as long as it takes for each result
+        connection.settimeout(None)
+        for line in connection.makefile("rb"):
+            reply = json.loads(line)
+            if not reply["ok"]:
+                raise RuntimeError(reply["error"])
+            yield reply["result"]
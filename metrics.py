@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+## Metrics
+Lightweight timing spans for the motion controller. Spans are kept in a
+fixed-size ring buffer and counted into histograms as they are recorded, so
+recording costs a few array writes and scrapes only read the totals. Renders
+totals in Prometheus text format.
+"""
+
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Iterator, Optional
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+# Upper bounds of histogram buckets in seconds, from short moves to whole jobs
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Most recent spans kept
+RING_SIZE = 4096
+PREFIX = "stamper"
+
+
+class Recorder:
+    """
+    Records timing spans of named phases into a ring buffer and histograms.
+    """
+
+    def __init__(self, clock: Any = time, size: int = RING_SIZE) -> None:
+        """
+        Starts empty recorder. Optional clock with a perf_counter function and
+        ring buffer size parameters.
+        """
+        self.clock = clock
+        self.size = size
+        # Phase, start and duration of recent spans, written round in a ring
+        self._phases = array("H", bytes(2 * size))
+        self._starts = array("d", bytes(8 * size))
+        self._durations = array("d", bytes(8 * size))
+        self._written = 0
+        # Phase names by number, and bucket counts, sum and count of each
+        self._names: list[str] = []
+        self._numbers: dict[str, int] = {}
+        self._counts: list[list[int]] = []
+        self._sums: list[float] = []
+        self._lock = Lock()
+
+    def record(self, name: str, start: float, seconds: float) -> None:
+        """
+        Records span of phase. Takes phase name, start time and duration in
+        seconds as parameters.
+        """
+        with self._lock:
+            number = self._numbers.get(name)
+            if number is None:
+                number = self._numbers[name] = len(self._names)
+                self._names.append(name)
+                self._counts.append([0] * (len(BUCKETS) + 1))
+                self._sums.append(0.0)
+            slot = self._written % self.size
+            self._phases[slot] = number
+            self._starts[slot] = start
+            self._durations[slot] = seconds
+            self._written += 1
+            self._counts[number][bisect_left(BUCKETS, seconds)] += 1
+            self._sums[number] += seconds
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Records how long the block inside takes as a span of phase, unless it
+        raises an error.
+        """
+        start = self.clock.perf_counter()
+        yield
+        self.record(name, start, self.clock.perf_counter() - start)
+
+    def recent(self, limit: Optional[int] = None) -> list[tuple[str, float, float]]:
+        """
+        Returns phase, start and duration of spans still in ring buffer, in
+        order recorded. Optional limit on number of spans parameter.
+        """
+        with self._lock:
+            kept = min(self._written, self.size, limit or self.size)
+            slots = [
+                (self._written - kept + index) % self.size for index in range(kept)
+            ]
+            return [
+                (
+                    self._names[self._phases[slot]],
+                    self._starts[slot],
+                    self._durations[slot],
+                )
+                for slot in slots
+            ]
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """
+        Returns cumulative bucket counts, sum and count of spans by phase.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "buckets": list(self._counts[number]),
+                    "sum": self._sums[number],
+                    "count": sum(self._counts[number]),
+                }
+                for number, name in enumerate(self._names)
+            }
+
+
+def render(
+    histograms: dict[str, dict[str, Any]],
+    gauges: dict[str, float],
+    jitter: Optional[dict[str, Any]] = None,
+) -> str:
+    """
+    Formats phase histograms and gauges as Prometheus text. Takes histograms
+    from Recorder.snapshot() and gauges by name as parameters. Optional half
+    step lateness parameter, from SteppingEngine.jitter().
+    """
+    lines = [
+        f"# HELP {PREFIX}_phase_seconds Time spent in each phase of printing.",
+        f"# TYPE {PREFIX}_phase_seconds histogram",
+    ]
+    for name, histogram in sorted(histograms.items()):
+        total = 0
+        # Buckets count every span up to their bound
+        for bound, count in zip(BUCKETS + (float("inf"),), histogram["buckets"]):
+            total += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(
+                f'{PREFIX}_phase_seconds_bucket{{phase="{name}",le="{le}"}} {total}'
+            )
+        lines.append(f'{PREFIX}_phase_seconds_sum{{phase="{name}"}} {histogram["sum"]}')
+        lines.append(f'{PREFIX}_phase_seconds_count{{phase="{name}"}} {total}')
+    jobs = histograms.get("job", {}).get("count", 0)
+    lines += [
+        f"# HELP {PREFIX}_jobs_printed_total Codes printed since controller started.",
+        f"# TYPE {PREFIX}_jobs_printed_total counter",
+        f"{PREFIX}_jobs_printed_total {jobs}",
+    ]
+    if jitter is not None:
+        lines += [
+            f"# HELP {PREFIX}_step_lateness_seconds How late each half step was written.",
+            f"# TYPE {PREFIX}_step_lateness_seconds histogram",
+        ]
+        total = 0
+        # Buckets count every half step up to their edge
+        for edge, count in jitter["buckets_us"].items():
+            total += count
+            le = "+Inf" if edge == "inf" else repr(int(edge) / 1e6)
+            lines.append(f'{PREFIX}_step_lateness_seconds_bucket{{le="{le}"}} {total}')
+        lines += [
+            f"{PREFIX}_step_lateness_seconds_sum {jitter['total_us'] / 1e6}",
+            f"{PREFIX}_step_lateness_seconds_count {total}",
+            f"# TYPE {PREFIX}_step_lateness_worst_seconds gauge",
+            f"{PREFIX}_step_lateness_worst_seconds {jitter['worst_us'] / 1e6}",
+        ]
+    for name, value in gauges.items():
+        lines += [f"# TYPE {PREFIX}_{name} gauge", f"{PREFIX}_{name} {value}"]
+    return "\n".join(lines) + "\n"
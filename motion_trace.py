@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+## Motion Trace
+Records every motor move, limit switch read and phase of the chassis into a
+compact binary trace file, and analyzes traces offline. Records are fixed
+width so a trace can be memory-mapped as an array. Recording only appends to
+a buffer in memory, and a background thread writes it to the file, so step
+timing is never held up by the disk.
+
+Record a trace by setting `STAMPER_TRACE=<file>` before starting `stamper`.
+Analyze one with:
+$ python motion_trace.py <file>
+
+Dependencies: numpy
+"""
+
+import json
+import struct
+import sys
+from threading import Event, Lock, Thread
+from typing import Any, Optional
+
+import numpy as np
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+# Start and end time, kind, axis, direction, switch level, switch pin, phase,
+# steps and RPM of every record
+RECORD = struct.Struct("<ddBBbBHHff")
+DTYPE = np.dtype(
+    [
+        ("start", "<f8"),
+        ("end", "<f8"),
+        ("kind", "u1"),
+        ("axis", "u1"),
+        ("direction", "i1"),
+        ("level", "u1"),
+        ("pin", "<u2"),
+        ("phase", "<u2"),
+        ("steps", "<f4"),
+        ("rpm", "<f4"),
+    ]
+)
+# Header is one record long so records stay aligned
+MAGIC = b"STMPTRC1"
+HEADER = MAGIC.ljust(RECORD.size, b"\0")
+# Seconds between writes to file
+FLUSH_INTERVAL = 0.5
+# Names of axes and phases, by number stored in records
+AXES = ("wheel", "horizontal", "vertical")
+PHASES = (
+    "job",
+    "zero_horizontal",
+    "zero_vertical",
+    "advance_character",
+    "dip",
+    "move_horizontal",
+)
+# Shortest gap between moves reported as idle
+MIN_GAP = 0.001
+
+
+class Kinds:
+    """
+    Establishes kinds of trace record.
+    """
+
+    SEGMENT = 0
+    LIMIT = 1
+    PHASE = 2
+
+
+class Tracer:
+    """
+    Buffers trace records in memory and writes them to file in a background
+    thread.
+    """
+
+    def __init__(self, filename: str, interval: float = FLUSH_INTERVAL) -> None:
+        """
+        Starts new trace file. Takes file name as parameter. Optional seconds
+        between writes parameter.
+        """
+        self._file = open(filename, "wb")
+        self._file.write(HEADER)
+        self._buffer = bytearray()
+        self._lock = Lock()
+        self._closed = Event()
+        self._interval = interval
+        self._thread = Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def segment(
+        self,
+        axis: int,
+        direction: int,
+        start: float,
+        end: float,
+        steps: float,
+        rpm: float,
+    ) -> None:
+        """
+        Records motor move. Takes axis, direction, start and end times, steps
+        taken and fastest RPM as parameters.
+        """
+        self._append(start, end, Kinds.SEGMENT, axis, direction, 0, 0, 0, steps, rpm)
+
+    def limit(self, pin: int, level: int, time: float) -> None:
+        """
+        Records limit switch read or edge. Takes pin, level and time as
+        parameters.
+        """
+        self._append(time, time, Kinds.LIMIT, 0, 0, level, pin, 0, 0.0, 0.0)
+
+    def phase(self, name: str, start: float, end: float) -> None:
+        """
+        Records phase of chassis. Takes phase name, start and end times as
+        parameters.
+        """
+        phase = PHASES.index(name)
+        self._append(start, end, Kinds.PHASE, 0, 0, 0, 0, phase, 0.0, 0.0)
+
+    def _append(self, *fields: Any) -> None:
+        packed = RECORD.pack(*fields)
+        with self._lock:
+            self._buffer += packed
+
+    def flush(self) -> None:
+        """
+        Writes buffered records to file.
+        """
+        with self._lock:
+            buffer, self._buffer = self._buffer, bytearray()
+        if buffer:
+            self._file.write(buffer)
+            self._file.flush()
+
+    def close(self) -> None:
+        """
+        Writes remaining records and closes file.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self._interval):
+            self.flush()
+
+
+def load(filename: str) -> np.ndarray:
+    """
+    Memory-maps records of trace file. Raises ValueError if file is not a
+    trace.
+    """
+    with open(filename, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a motion trace!")
+    return np.memmap(filename, dtype=DTYPE, mode="r", offset=RECORD.size)
+
+
+def _merge(starts: np.ndarray, ends: np.ndarray) -> list[tuple[float, float]]:
+    """
+    Merges overlapping intervals. Returns merged intervals in order.
+    """
+    merged: list[tuple[float, float]] = []
+    for start, end in sorted(zip(starts.tolist(), ends.tolist())):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def critical_path(segments: np.ndarray) -> dict[str, float]:
+    """
+    Follows moves back from the last one to finish, each time taking the
+    move that finished last before the current one started. Returns seconds
+    of that path spent on each axis and idle.
+    """
+    path = dict.fromkeys(AXES + ("idle",), 0.0)
+    if not len(segments):
+        return path
+    order = np.argsort(segments["end"], kind="stable")
+    ends = segments["end"][order]
+    now = float(ends[-1])
+    while True:
+        # Latest move finished by now
+        index = int(np.searchsorted(ends, now + 1e-9, side="right")) - 1
+        if index < 0:
+            break
+        segment = segments[order[index]]
+        end, start = float(segment["end"]), float(segment["start"])
+        path["idle"] += now - end
+        path[AXES[segment["axis"]]] += end - start
+        # Moves that end exactly where they start cannot move path back
+        if start >= now:
+            ends = ends[:index]
+            order = order[:index]
+            continue
+        now = start
+    return path
+
+
+def analyze(filename: str, gaps: int = 5) -> dict[str, Any]:
+    """
+    Replays trace. Returns time spent moving each axis, idle gaps with no
+    axis moving, critical path across axes, phase totals and limit switch
+    reads. Optional number of longest gaps to list parameter.
+    """
+    records = load(filename)
+    segments = records[records["kind"] == Kinds.SEGMENT]
+    phases = records[records["kind"] == Kinds.PHASE]
+    limits = records[records["kind"] == Kinds.LIMIT]
+    report: dict[str, Any] = {"records": len(records)}
+    if not len(segments):
+        return report
+    first, last = float(segments["start"].min()), float(segments["end"].max())
+    report["seconds"] = last - first
+    # Time each axis spent moving, counting its overlapping moves once
+    report["axes"] = {}
+    for number, name in enumerate(AXES):
+        moves = segments[segments["axis"] == number]
+        busy = _merge(moves["start"], moves["end"])
+        report["axes"][name] = {
+            "moves": len(moves),
+            "steps": float(moves["steps"].sum()),
+            "seconds": sum(end - start for start, end in busy),
+        }
+    # Gaps with no axis moving
+    busy = _merge(segments["start"], segments["end"])
+    idle = [
+        (before[1], after[0] - before[1])
+        for before, after in zip(busy, busy[1:])
+        if after[0] - before[1] >= MIN_GAP
+    ]
+    report["idle"] = {
+        "seconds": sum(length for _, length in idle),
+        "gaps": len(idle),
+        "longest": [
+            {"at": at - first, "seconds": length}
+            for at, length in sorted(idle, key=lambda gap: -gap[1])[:gaps]
+        ],
+    }
+    report["critical_path"] = critical_path(segments)
+    report["phases"] = {
+        name: {
+            "count": int((phases["phase"] == number).sum()),
+            "seconds": float(
+                (phases["end"] - phases["start"])[phases["phase"] == number].sum()
+            ),
+        }
+        for number, name in enumerate(PHASES)
+        if (phases["phase"] == number).any()
+    }
+    report["limit_reads"] = {
+        "total": len(limits),
+        "closed": int((limits["level"] == 0).sum()),
+    }
+    return report
+
+
+def main() -> None:
+    """
+    Analyzes trace files given on command line and prints reports as JSON.
+    """
+    for filename in sys.argv[1:]:
+        print(json.dumps({filename: analyze(filename)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
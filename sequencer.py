@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+## Sequencer
+Orders batches of codes so that the stamper wheel turns as little as possible
+between codes and characters need fresh ink as rarely as possible. Inking is
+costed as Chassis.print_batch() does it, once per batch of codes for every
+character the batch uses.
+
+Dependencies: numpy
+"""
+
+import sys
+import time
+from collections import deque
+from typing import Iterable, Sequence
+
+import numpy as np
+
+import geometry
+from geometry import (
+    BATCH_SIZE,
+    CHARACTERS,
+    STARTING_CHARACTER,
+    STEPS_PER_REVOLUTION,
+    NumSteps,
+)
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+
+class Costs:
+    """
+    Establishes estimated seconds for moves that depend on code order.
+    """
+
+    # Turning wheel one character
+    WHEEL_STAGE = NumSteps.ADVANCE_CHARACTER / (
+        geometry.WHEEL_RPM / 60 * STEPS_PER_REVOLUTION
+    )
+    # Dipping one character in ink, half at full speed and half slowed
+    INK_CHARACTER = (
+        NumSteps.SURFACE_MARGIN / (geometry.MOVE_RPM / 60 * STEPS_PER_REVOLUTION)
+        + NumSteps.SURFACE_MARGIN
+        / (geometry.MOVE_RPM * 0.3 / 60 * STEPS_PER_REVOLUTION)
+        + 0.5
+    )
+
+
+# Number of set bits in every 16 bit character mask
+_POPCOUNT = np.array([bin(mask).count("1") for mask in range(1 << 16)], np.uint8)
+# Stages between every pair of wheel characters
+_STAGES = np.array(
+    [[abs(geometry.distance(old, new)) for new in CHARACTERS] for old in CHARACTERS],
+    np.int64,
+)
+
+
+def _to_indices(codes: Sequence[str]) -> np.ndarray:
+    """
+    Converts codes of equal length to array of wheel indices, one row per
+    code.
+    """
+    length = len(codes[0])
+    if any(len(code) != length for code in codes):
+        raise ValueError("Codes must all be the same length.")
+    # Maps each byte to its wheel index, marking others as invalid
+    lookup = np.full(256, 255, np.uint8)
+    for index, character in enumerate(CHARACTERS):
+        lookup[ord(character)] = lookup[ord(character.lower())] = index
+    raw = np.frombuffer("".join(codes).encode("ascii"), np.uint8)
+    indices = lookup[raw].reshape(len(codes), length)
+    if (indices == 255).any():
+        raise ValueError("Codes must be in hexadecimal.")
+    return indices
+
+
+def _to_masks(indices: np.ndarray) -> np.ndarray:
+    """
+    Returns bit mask of characters used by each code.
+    """
+    return np.bitwise_or.reduce(
+        np.left_shift(1, indices.astype(np.int64)), axis=1
+    ).astype(np.int64)
+
+
+def sequence_cost(
+    codes: Sequence[str],
+    order: Iterable[int],
+    start: str = STARTING_CHARACTER,
+    batch_size: int = BATCH_SIZE,
+) -> float:
+    """
+    Estimates seconds spent turning the wheel and inking between codes when
+    printed in specified order. Each batch of codes is inked once for every
+    character it uses. Re-inks of ink grown too old or too used within a
+    batch are left out. Optional starting wheel character and batch size
+    parameters.
+    """
+    order = np.fromiter(order, np.int64)
+    if not len(order):
+        return 0.0
+    indices = _to_indices(codes)[order]
+    masks = _to_masks(indices)
+    # Wheel ends each code on its last character
+    lasts = np.concatenate(([geometry.index_of(start)], indices[:-1, -1]))
+    # Every character used by a batch is inked once
+    batch_masks = np.bitwise_or.reduceat(masks, np.arange(0, len(masks), batch_size))
+    return float(
+        Costs.WHEEL_STAGE * _STAGES[lasts, indices[:, 0]].sum()
+        + Costs.INK_CHARACTER * _POPCOUNT[batch_masks & 0xFFFF].sum()
+    )
+
+
+def sequence(
+    codes: Sequence[str],
+    constraints: Iterable[tuple[int, int]] = (),
+    start: str = STARTING_CHARACTER,
+    batch_size: int = BATCH_SIZE,
+) -> list[int]:
+    """
+    Orders codes to reduce wheel travel and inking between them, filling each
+    batch with codes that add fewest characters to its inking. Takes codes as
+    parameter. Optional constraints parameter of (before, after) index pairs
+    that must keep their order, starting wheel character and batch size.
+    Returns indices of codes in print order.
+    """
+    if not codes:
+        return []
+    indices = _to_indices(codes)
+    masks = _to_masks(indices)
+    firsts = indices[:, 0].astype(np.int64)
+    lasts = indices[:, -1].astype(np.int64)
+    # Groups codes that cost the same to move to: same first character and
+    # same characters used
+    keys, buckets = np.unique(firsts << 16 | masks, return_inverse=True)
+    bucket_firsts = keys >> 16
+    bucket_masks = keys & 0xFFFF
+    # Wheel cost to each group from each possible last character
+    wheel_costs = Costs.WHEEL_STAGE * _STAGES[:, bucket_firsts]
+    # Counts constraints holding back each code
+    blocking: list[list[int]] = [[] for _ in codes]
+    waiting = np.zeros(len(codes), np.int64)
+    for before, after in constraints:
+        blocking[before].append(after)
+        waiting[after] += 1
+    # Fills groups with codes free to print, in original order
+    members = [deque() for _ in keys]
+    for index in np.flatnonzero(waiting == 0):
+        members[buckets[index]].append(int(index))
+    counts = np.array([len(group) for group in members], np.int64)
+    # Remembers best group for each wheel state and characters inked for
+    # current batch
+    best: dict[tuple[int, int], int] = {}
+    last, mask = geometry.index_of(start), 0
+    order: list[int] = []
+    for _ in range(len(codes)):
+        bucket = best.get((last, mask))
+        # Finds cheapest non-empty group if remembered one has run out
+        if bucket is None or not counts[bucket]:
+            costs = (
+                wheel_costs[last]
+                + Costs.INK_CHARACTER * _POPCOUNT[bucket_masks & ~mask & 0xFFFF]
+            )
+            costs[counts == 0] = np.inf
+            bucket = int(np.argmin(costs))
+            if not counts[bucket]:
+                raise ValueError("Ordering constraints contain a cycle.")
+            best[(last, mask)] = bucket
+        # Takes next code from group
+        index = members[bucket].popleft()
+        counts[bucket] -= 1
+        order.append(index)
+        last, mask = int(lasts[index]), mask | int(masks[index])
+        # Next batch is inked afresh
+        if not len(order) % batch_size:
+            mask = 0
+        # Frees codes that were waiting on this one
+        for after in blocking[index]:
+            waiting[after] -= 1
+            if not waiting[after]:
+                members[buckets[after]].append(after)
+                counts[buckets[after]] += 1
+                # New options may beat remembered ones
+                best.clear()
+    return order
+
+
+def main() -> None:
+    """
+    Orders codes read from file or standard input, one per line, and reports
+    estimated time saved.
+    """
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as file:
+            codes = [line.strip().upper() for line in file if line.strip()]
+    else:
+        codes = [line.strip().upper() for line in sys.stdin if line.strip()]
+    # Orders codes and times it
+    start_time = time.perf_counter()
+    order = sequence(codes)
+    elapsed = time.perf_counter() - start_time
+    # Reports costs before and after
+    before = sequence_cost(codes, range(len(codes)))
+    after = sequence_cost(codes, order)
+    print(f"Ordered {len(codes)} codes in {elapsed:.2f} s", file=sys.stderr)
+    print(f"Estimated seconds: {before:.0f} -> {after:.0f}", file=sys.stderr)
+    for index in order:
+        print(codes[index])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+## Simulator
+Simulated GPIO and stepper backend with a virtual clock, so the stamper runs
+on any machine and faster than real time. Every coil write and limit switch
+change is recorded. Limit switches close when an axis reaches zero.
+
+Select it by setting `STAMPER_BACKEND=sim` before importing `stamper`.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from array import array
+from typing import Any, Callable, Optional
+
+from geometry import STEPS_PER_REVOLUTION
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+# Coil states for each half step, as written by stepping engine
+HALFSTEP = (
+    (1, 0, 0, 0),
+    (1, 1, 0, 0),
+    (0, 1, 0, 0),
+    (0, 1, 1, 0),
+    (0, 0, 1, 0),
+    (0, 0, 1, 1),
+    (0, 0, 0, 1),
+    (1, 0, 0, 1),
+)
+# Steps from limit switch each axis starts at
+START_POSITION = 500.0
+
+
+class VirtualClock:
+    """
+    Clock that only moves forward when slept on, so simulated moves take no
+    real time. Used in place of the time module.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.now = start
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            self.now += seconds
+
+    def set(self, now: float) -> None:
+        """
+        Moves clock to specified time, used to run simulated moves that
+        happen at the same time one after another.
+        """
+        self.now = now
+
+
+class _Axis:
+    """
+    Simulated motor, with the limit switch it closes, if any.
+    """
+
+    def __init__(
+        self, number: int, limit_pin: Optional[int], sign: int, position: float
+    ) -> None:
+        self.number = number
+        self.limit_pin = limit_pin
+        # Change in position for each half step forward
+        self.sign = sign
+        self.position = position
+        self.phase = 0
+        self.half_steps = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.limit_pin is not None and self.position <= 0
+
+
+class SimulatedGPIO:
+    """
+    Stands in for RPi.GPIO. Follows motor positions from coil phases written
+    and reports limit switches closed at zero.
+    """
+
+    BCM = 11
+    IN = 1
+    OUT = 0
+    PUD_UP = 22
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, clock: VirtualClock) -> None:
+        self.clock = clock
+        self._axes: dict[tuple[int, ...], _Axis] = {}
+        self._limits: dict[int, _Axis] = {}
+        self._callbacks: dict[int, tuple[int, Callable[[int], None]]] = {}
+        # Every coil write: time, motor number and phase
+        self.times = array("d")
+        self.motors = array("b")
+        self.phases = array("b")
+        # Every limit switch change: time, pin and level
+        self.limit_changes: list[tuple[float, int, int]] = []
+
+    def add_axis(
+        self,
+        coil_pins: tuple[int, ...],
+        limit_pin: Optional[int] = None,
+        sign: int = 1,
+        start: float = START_POSITION,
+    ) -> None:
+        """
+        Adds motor to simulate. Takes coil pins as parameter. Optional limit
+        switch pin, which closes at position zero, direction of position
+        change for forward half steps, and starting position in steps.
+        """
+        axis = _Axis(len(self._axes), limit_pin, sign, start)
+        self._axes[tuple(coil_pins)] = axis
+        if limit_pin is not None:
+            self._limits[limit_pin] = axis
+
+    def position(self, coil_pins: tuple[int, ...]) -> float:
+        """
+        Returns simulated position of motor in steps.
+        """
+        return self._axes[tuple(coil_pins)].position
+
+    def setmode(self, mode: int) -> None:
+        pass
+
+    def setwarnings(self, warnings: bool) -> None:
+        pass
+
+    def setup(self, channel, direction: int, pull_up_down=None, initial=None) -> None:
+        pass
+
+    def cleanup(self, *channels) -> None:
+        pass
+
+    def input(self, pin: int) -> int:
+        # Switch pulls pin low when closed
+        axis = self._limits.get(pin)
+        return self.LOW if axis is not None and axis.closed else self.HIGH
+
+    def output(self, channel, value) -> None:
+        axis = self._axes.get(tuple(channel)) if isinstance(channel, tuple) else None
+        if axis is None:
+            return
+        phase = HALFSTEP.index(tuple(value))
+        was_closed = axis.closed
+        # Moves a half step towards new phase
+        delta = (phase - axis.phase + 4) % 8 - 4
+        axis.position += delta / 2 * axis.sign
+        axis.phase = phase
+        axis.half_steps += abs(delta)
+        self.times.append(self.clock.now)
+        self.motors.append(axis.number)
+        self.phases.append(phase)
+        # Records switch changes and calls edge callbacks
+        if axis.limit_pin is not None and axis.closed != was_closed:
+            level = self.LOW if axis.closed else self.HIGH
+            self.limit_changes.append((self.clock.now, axis.limit_pin, level))
+            edge, callback = self._callbacks.get(axis.limit_pin, (None, None))
+            falling = edge in (self.FALLING, self.BOTH) and level == self.LOW
+            rising = edge in (self.RISING, self.BOTH) and level == self.HIGH
+            if callback is not None and (falling or rising):
+                callback(axis.limit_pin)
+
+    def add_event_detect(self, pin: int, edge: int, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin: int) -> None:
+        self._callbacks.pop(pin, None)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Returns half steps written and position of each simulated motor.
+        """
+        return {
+            str(pins): {"half_steps": axis.half_steps, "position": axis.position}
+            for pins, axis in self._axes.items()
+        }
+
+
+class _Directions:
+    CLOCKWISE = 1
+    COUNTER_CLOCKWISE = -1
+
+
+class _Sequences:
+    HALFSTEP = HALFSTEP
+
+
+class _Motor:
+    def __init__(self, pins: tuple[int, ...]) -> None:
+        self.pins = tuple(pins)
+
+
+class SimulatedStepper:
+    """
+    Stands in for the motors.stepper library, writing to simulated GPIO.
+    """
+
+    Directions = _Directions
+    Sequences = _Sequences
+    Motor = _Motor
+
+    def __init__(self, gpio: SimulatedGPIO) -> None:
+        self.gpio = gpio
+
+    def board_setup(self) -> None:
+        pass
+
+    def board_cleanup(self) -> None:
+        pass
+
+    def step_motor(
+        self,
+        motor: _Motor,
+        num_steps: float,
+        direction: int,
+        sequence: tuple = HALFSTEP,
+        rpm: float = 10.0,
+    ) -> float:
+        """
+        Writes half steps to motor, advancing clock at rate of RPM. Returns
+        signed number of steps taken.
+        """
+        interval = 60 / (rpm * STEPS_PER_REVOLUTION * 2)
+        axis = self.gpio._axes[motor.pins]
+        for _ in range(round(abs(num_steps) * 2)):
+            phase = (axis.phase + direction) % len(sequence)
+            self.gpio.output(motor.pins, sequence[phase])
+            self.gpio.clock.sleep(interval)
+        return abs(num_steps) * direction
+
+
+# Shared simulated hardware for this process
+clock = VirtualClock()
+GPIO = SimulatedGPIO(clock)
+stepper = SimulatedStepper(GPIO)
+
+
+def crash_check(chassis: Any, code: str) -> list[tuple[int, list, list]]:
+    """
+    Inks and prints code once for every point between stages it could crash
+    at, stopping there, and compares positions checkpointed in journal with
+    positions stamped onto floor by the stages that ran. Takes chassis and
+    code as parameters. Returns crash point, positions stamped and positions
+    journaled wherever they differ.
+    """
+    import checkpoints
+    import stamper
+
+    start = chassis.state()
+    ink = stamper.compile_plan("ink", code, start)
+    plans = [ink, stamper.compile_plan("print", code, ink.end_states[-1])]
+    # Floor positions touched by every stage, in order run
+    touched = [
+        _floor_touched(plan, stage)
+        for plan in plans
+        for stage in range(len(plan.stages))
+    ]
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for point in range(len(touched) + 1):
+            journal = checkpoints.Journal(
+                os.path.join(directory, f"{point}.journal"), sync=False
+            )
+            stamper.journal = journal
+            journal.begin(0)
+            chassis._set_state(start)
+            # Runs stages up to crash point, then stops dead as power loss
+            # would, so nothing that run_plan() does afterwards runs either
+            chassis._run_lane = _crashing(chassis._run_lane, plans, point)
+            try:
+                for plan in plans:
+                    chassis.run_plan(plan)
+            except _Crash:
+                pass
+            finally:
+                del chassis._run_lane
+            journal.close()
+            stamper.journal = None
+            stamped = sorted(set().union(*touched[:point]))
+            journaled = sorted(journal.printed(0))
+            if stamped != journaled:
+                failures.append((point, stamped, journaled))
+    return failures
+
+
+class _Crash(Exception):
+    """
+    Raised to stop a plan dead at a crash point.
+    """
+
+
+def _crashing(run_lane: Callable, plans: list, point: int) -> Callable:
+    """
+    Wraps lane runner of chassis to raise _Crash once stage at crash point
+    of plans is reached. Takes lane runner, plans in order run and number of
+    stages to run before crashing as parameters.
+    """
+    # Stages run before each plan
+    offsets = {
+        id(plan): sum(len(p.stages) for p in plans[:i]) for i, plan in enumerate(plans)
+    }
+
+    def run(plan: Any, start: int, end: int, times: Any) -> None:
+        stage = next(
+            index for index, lanes in enumerate(plan.stages) if (start, end) in lanes
+        )
+        if offsets[id(plan)] + stage >= point:
+            raise _Crash()
+        run_lane(plan, start, end, times)
+
+    return run
+
+
+def _floor_touched(plan: Any, stage: int) -> set[int]:
+    """
+    Follows every step of stage of plan. Returns positions of code at which
+    stamp touches floor.
+    """
+    import stamper
+
+    state = plan.end_states[stage - 1] if stage else plan.start
+    positions = set()
+    for start, end in plan.stages[stage]:
+        horizontal, vertical = state.horizontal, state.vertical
+        for index in range(start, end):
+            steps = plan.steps[index] * plan.directions[index]
+            if plan.axes[index] == stamper.Axes.HORIZONTAL:
+                horizontal += steps * stamper.Directions.RIGHT
+            elif plan.axes[index] == stamper.Axes.VERTICAL:
+                vertical += steps * stamper.Directions.DOWN
+            if horizontal >= stamper.NumSteps.INK_WIDTH and stamper.Chassis._touches(
+                horizontal, vertical
+            ):
+                positions.add(
+                    round(
+                        (horizontal - stamper.NumSteps.INK_WIDTH)
+                        / stamper.NumSteps.CHARACTER_WIDTH
+                    )
+                )
+    return positions
+
+
+def main() -> None:
+    """
+    Prints codes given on command line on simulated hardware and reports
+    simulated and real time taken. Add --slow to print with print_slow(), or
+    --adaptive to print with print_adaptive(). Add --crash-check to check
+    instead that a crash between any two stages leaves every stamped
+    position checkpointed.
+    """
+    os.environ["STAMPER_BACKEND"] = "sim"
+    import simulator
+    import stamper
+
+    slow = "--slow" in sys.argv
+    adaptive = "--adaptive" in sys.argv
+    codes = [arg.upper() for arg in sys.argv[1:] if not arg.startswith("--")]
+    chassis = stamper.Chassis(stamper.STARTING_CHARACTER)
+    if "--crash-check" in sys.argv:
+        failed = False
+        for code in codes:
+            failures = crash_check(chassis, code)
+            for point, stamped, journaled in failures:
+                print(
+                    f"{code} crash after stage {point}: stamped {stamped}, journaled {journaled}"
+                )
+            print(
+                f"{code}: {'FAILED' if failures else 'every stamped position journaled'}"
+            )
+            failed = failed or bool(failures)
+        sys.exit(1 if failed else 0)
+    for code in codes:
+        start, real_start = simulator.clock.now, time.perf_counter()
+        if slow:
+            chassis.print_slow(code)
+        elif adaptive:
+            chassis.print_adaptive(code)
+        else:
+            chassis.print_fast(code)
+        print(
+            f"{code}: {simulator.clock.now - start:.2f} s simulated, "
+            f"{time.perf_counter() - real_start:.3f} s real"
+        )
+    print(f"Coil writes: {len(simulator.GPIO.times)}")
+
+
+if __name__ == "__main__":
+    main()
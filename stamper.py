@@ -1,20 +1,34 @@
 #!/usr/bin/env python
 """
 ## Stamper
-Allows for full control of stamper robot. Chassis object controls wheel 
-position and orientation.
+Allows for full control of stamper robot. Chassis object controls wheel
+position and orientation. Hardware libraries are only imported and set up by
+init_hardware(), which runs on first move, so plans can be compiled and the
+module imported without a board.
 """
 
+import atexit
+import os
+import signal
+import sys
 import time
-from math import copysign
-from threading import Thread
-from typing import Callable
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache, partial, wraps
+from itertools import permutations
+from math import copysign, sqrt
+from threading import Condition, Event, Lock, RLock, Thread
+from typing import Any, Callable, Iterator, NamedTuple, Optional
 
-import RPi.GPIO as GPIO
-
-import webapp
-from motors import stepper
-from storage import Cells, get_cell, set_cell
+import checkpoints
+import events
+import geometry
+from geometry import STARTING_CHARACTER, NumSteps
+from ipc import ControllerServer
+import metrics
+from storage import Cells, JobStates, get_cell, jobs, next_jobs, set_cell, store
 
 __author__ = "Ben Kraft"
 __copyright__ = "None"
@@ -25,21 +39,44 @@ __maintainer__ = "Ben Kraft"
 __email__ = "ben.kraft@rcn.com"
 __status__ = "Prototype"
 
-STARTING_CHARACTER = "0"
+# Runs on simulated hardware and clock when asked to, so stamper works off a Pi
+SIMULATED = os.environ.get("STAMPER_BACKEND", "").lower() == "sim"
+if SIMULATED:
+    from simulator import clock
+else:
+    clock = time
+# GPIO and stepper libraries, imported by init_hardware()
+GPIO: Any = None
+stepper: Any = None
+_hardware_lock = Lock()
+
+# Timing spans of print phases, measured on the same clock as moves
+recorder = metrics.Recorder(clock)
+# Job progress published to web process
+broadcaster = events.Broadcaster()
+# Trace of every move, limit switch read and phase, if asked for
+tracer: Any = None
+if os.environ.get("STAMPER_TRACE"):
+    import motion_trace
 
-# Sets up board with BCM
-stepper.board_setup()
+    tracer = motion_trace.Tracer(os.environ["STAMPER_TRACE"])
+    atexit.register(tracer.close)
+# Checkpoints of characters inked and printed, opened by main()
+journal: Any = None
 
 
 class Directions:
     """
-    Establishes stamper movement directions.
+    Establishes stamper movement directions, as the stepper library numbers
+    them.
     """
 
-    DOWN = stepper.Directions.COUNTER_CLOCKWISE
-    UP = stepper.Directions.CLOCKWISE
-    LEFT = stepper.Directions.COUNTER_CLOCKWISE
-    RIGHT = stepper.Directions.CLOCKWISE
+    CLOCKWISE = 1
+    COUNTER_CLOCKWISE = -1
+    DOWN = COUNTER_CLOCKWISE
+    UP = CLOCKWISE
+    LEFT = COUNTER_CLOCKWISE
+    RIGHT = CLOCKWISE
 
 
 class Pins:
@@ -49,40 +86,470 @@ class Pins:
 
     HORIZONTAL_LIMIT = 18
     VERTICAL_LIMIT = 4
+    # Stop button, pulled low when pressed
+    STOP_BUTTON = 21
+    # Coil pins for each motor
+    STAMPER_WHEEL = (16, 19, 20, 26)
+    HORIZONTAL_MOVE = (5, 6, 12, 13)
+    VERTICAL_MOVE = (17, 22, 23, 27)
 
 
-# Sets up limit switches with internal pull up resistor
-for pin in (Pins.HORIZONTAL_LIMIT, Pins.VERTICAL_LIMIT):
-    GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)  # type: ignore
+class Motors:
+    """
+    Establishes motor objects used in stamper, once hardware is set up.
+    """
 
+    STAMPER_WHEEL: Any = None
+    HORIZONTAL_MOVE: Any = None
+    VERTICAL_MOVE: Any = None
 
-class Motors:
+
+def init_hardware() -> None:
+    """
+    Imports GPIO and stepper libraries, sets up board with BCM, limit switch
+    and coil pins, and creates motor objects. Only sets up once, however
+    often it is called.
+    """
+    global GPIO, stepper
+    if stepper is not None:
+        return
+    with _hardware_lock:
+        if stepper is not None:
+            return
+        if SIMULATED:
+            import simulator as backend
+
+            gpio, library = backend.GPIO, backend.stepper
+            # Tells simulator where limit switches close along each axis
+            gpio.add_axis(Pins.HORIZONTAL_MOVE, Pins.HORIZONTAL_LIMIT, Directions.RIGHT)
+            gpio.add_axis(Pins.VERTICAL_MOVE, Pins.VERTICAL_LIMIT, Directions.DOWN)
+            gpio.add_axis(Pins.STAMPER_WHEEL)
+        else:
+            import RPi.GPIO as gpio  # type: ignore
+            from motors import stepper as library  # type: ignore
+        library.board_setup()
+        # Sets up limit switches and stop button with internal pull up resistor
+        for pin in (Pins.HORIZONTAL_LIMIT, Pins.VERTICAL_LIMIT, Pins.STOP_BUTTON):
+            gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+        # Halts motors from GPIO callback thread as soon as button is pressed
+        gpio.add_event_detect(
+            Pins.STOP_BUTTON,
+            gpio.FALLING,
+            callback=lambda _: request_stop("stop button pressed"),
+            bouncetime=SteppingEngine.STOP_BOUNCE_MS,
+        )
+        # Sets up motor coils for streaming steps directly
+        for coil_pins in (Pins.STAMPER_WHEEL, Pins.HORIZONTAL_MOVE, Pins.VERTICAL_MOVE):
+            gpio.setup(coil_pins, gpio.OUT)
+        Motors.STAMPER_WHEEL = library.Motor(Pins.STAMPER_WHEEL)
+        Motors.HORIZONTAL_MOVE = library.Motor(Pins.HORIZONTAL_MOVE)
+        Motors.VERTICAL_MOVE = library.Motor(Pins.VERTICAL_MOVE)
+        # Publishes stepper last, as it marks setup as done
+        GPIO = gpio
+        stepper = library
+
+
+def cleanup_hardware() -> None:
+    """
+    Cleans up board, if it was set up.
+    """
+    if stepper is not None:
+        stepper.board_cleanup()
+
+
+class Axes:
+    """
+    Establishes axis numbers used in compiled print plans.
+    """
+
+    WHEEL = 0
+    HORIZONTAL = 1
+    VERTICAL = 2
+    # Pause with no motor moving
+    DWELL = 3
+
+
+# Coil pins of motor driven on each axis, by axis number
+_AXIS_PINS = (Pins.STAMPER_WHEEL, Pins.HORIZONTAL_MOVE, Pins.VERTICAL_MOVE)
+
+
+class Homing:
+    """
+    Establishes speeds and distances for zeroing against limit switches.
+    """
+
+    # Approach until switch is hit
+    FAST_RPM = 160.0
+    # Back off switch and approach again slowly for a repeatable zero
+    BACK_OFF = 40.0
+    SLOW_RPM = 20.0
+    # Steps past position guess to keep looking for switch
+    STEP_BUFFER = 400.0
+    # Coil states for each half step
+    HALFSTEP_PHASES = (
+        (1, 0, 0, 0),
+        (1, 1, 0, 0),
+        (0, 1, 0, 0),
+        (0, 1, 1, 0),
+        (0, 0, 1, 0),
+        (0, 0, 1, 1),
+        (0, 0, 0, 1),
+        (1, 0, 0, 1),
+    )
+
+
+class Rehoming:
+    """
+    Establishes when chassis zeros again instead of trusting its tracked
+    position.
+    """
+
+    # Codes printed between routine zeroing
+    EVERY_JOBS = 25
+    # Steps from zero beyond which a closed limit switch means drift
+    DRIFT_TOLERANCE = 50.0
+
+
+class Surfaces:
+    """
+    Establishes surfaces stamp is dipped onto.
+    """
+
+    INK = "ink"
+    FLOOR = "floor"
+
+
+class Profile(NamedTuple):
+    """
+    Acceleration-limited speed profile for one axis. Speeds are in RPM,
+    acceleration in RPM per second and jerk in RPM per second squared. A jerk
+    of zero gives a trapezoidal profile.
+    """
+
+    max_rpm: float
+    start_rpm: float
+    acceleration: float
+    jerk: float = 0.0
+
+
+class Profiles:
+    """
+    Establishes speed profiles used for each axis. Each starts at the speed
+    the axis already runs at from standstill.
+    """
+
+    HORIZONTAL = Profile(max_rpm=200.0, start_rpm=80.0, acceleration=600.0, jerk=6000.0)
+    VERTICAL = Profile(max_rpm=200.0, start_rpm=80.0, acceleration=600.0, jerk=6000.0)
+    WHEEL = Profile(max_rpm=50.0, start_rpm=20.0, acceleration=200.0, jerk=2000.0)
+
+
+class ChassisState(NamedTuple):
+    """
+    Tracked chassis position that a print plan starts from or ends at.
+    """
+
+    character: str
+    wheel: int
+    horizontal: float
+    vertical: float
+
+
+class Plan:
+    """
+    Flat list of motor segments compiled from a print action. Segments are
+    stored column by column in arrays. Runs of segments form lanes, and the
+    lanes of a stage run at the same time. Records chassis state at the end
+    of every stage and messages to report before it.
+    """
+
+    def __init__(self, start: ChassisState, state: Callable[[], ChassisState]) -> None:
+        """
+        Starts empty plan. Takes start state and function returning chassis
+        state as parameters.
+        """
+        self.start = start
+        # One entry per segment
+        self.axes = array("b")
+        self.steps = array("d")
+        self.directions = array("b")
+        self.rpms = array("d")
+        self.dwells = array("d")
+        # Start and end segment of each lane, by stage
+        self.stages: list[list[tuple[int, int]]] = []
+        self.end_states: list[ChassisState] = []
+        self.marks: dict[int, list[str]] = {}
+        # Stage, surface and character of every dip
+        self.dips: list[tuple[int, str, str]] = []
+        # Name, first segment and end segment of every timed phase
+        self.phases: list[tuple[str, int, int]] = []
+        self._state = state
+        # Lanes of stage being recorded
+        self._lanes: list[tuple[int, int]] = []
+        self._lane_start: Optional[int] = None
+        self._depth = 0
+        self._after_nested = False
+
+    def __len__(self) -> int:
+        return len(self.axes)
+
+    def seconds(self) -> float:
+        """
+        Estimates seconds plan takes to run from step counts and speeds of its
+        segments. Lanes of a stage overlap, so each stage takes as long as its
+        longest lane.
+        """
+        return sum(self._stage_seconds(lanes) for lanes in self.stages)
+
+    def stage_starts(self) -> list[float]:
+        """
+        Estimates seconds from start of plan to start of each stage, followed
+        by seconds plan takes to run.
+        """
+        starts = [0.0]
+        for lanes in self.stages:
+            starts.append(starts[-1] + self._stage_seconds(lanes))
+        return starts
+
+    def ink_usage(self) -> tuple[float, int]:
+        """
+        Estimates oldest ink any character is stamped with, in seconds from
+        start of stage it was inked in, and most stamps made from one inking.
+        Stamps of characters inked before plan are not counted.
+        """
+        starts = self.stage_starts()
+        inked: dict[str, float] = {}
+        stamps: dict[str, int] = {}
+        oldest, most = 0.0, 0
+        for stage, surface, character in self.dips:
+            if surface == Surfaces.INK:
+                inked[character], stamps[character] = starts[stage], 0
+            elif character in inked:
+                oldest = max(oldest, starts[stage] - inked[character])
+                stamps[character] += 1
+                most = max(most, stamps[character])
+        return oldest, most
+
+    def _stage_seconds(self, lanes: list[tuple[int, int]]) -> float:
+        return max(self._lane_seconds(start, end) for start, end in lanes)
+
+    def _lane_seconds(self, start: int, end: int) -> float:
+        seconds = 0.0
+        previous = None
+        for index in range(start, end):
+            axis, direction = self.axes[index], self.directions[index]
+            if axis == Axes.DWELL:
+                seconds += self.dwells[index]
+                previous = None
+                continue
+            interval = 60 / (self.rpms[index] * Chassis.STEPS_PER_REVOLUTION * 2)
+            seconds += round(self.steps[index] * 2) * interval
+            # First half step of each move is written straight away
+            if previous != (axis, direction):
+                seconds -= interval
+            previous = (axis, direction)
+        return seconds
+
+    def add(
+        self, axis: int, steps: float, direction: int, rpm: float, dwell: float = 0.0
+    ) -> None:
+        """
+        Adds segment to lane being recorded.
+        """
+        if self._after_nested:
+            raise ValueError("Moves cannot follow nested moves in the same lane!")
+        if self._lane_start is None:
+            self._lane_start = len(self.axes)
+        self.axes.append(axis)
+        self.steps.append(steps)
+        self.directions.append(direction)
+        self.rpms.append(rpm)
+        self.dwells.append(dwell)
+
+    def mark(self, message: str) -> None:
+        """
+        Adds message to report when next stage starts.
+        """
+        self.marks.setdefault(len(self.stages), []).append(message)
+
+    def dip(self, surface: str, character: str) -> None:
+        """
+        Records that character is dipped onto surface in next stage.
+        """
+        self.dips.append((len(self.stages), surface, character))
+
+    def begin_parallel(self) -> None:
+        """
+        Starts recording moves that run at the same time.
+        """
+        if self._depth:
+            # Nested moves split the lane they are started from
+            if self._lane_start is not None:
+                raise ValueError("Nested moves must start their lane!")
+        else:
+            self._end_stage()
+        self._depth += 1
+
+    def next_lane(self) -> None:
+        """
+        Starts a new lane of moves running at the same time.
+        """
+        self._end_lane()
+        self._after_nested = False
+
+    def end_parallel(self) -> None:
+        """
+        Finishes recording moves that run at the same time.
+        """
+        self._end_lane()
+        self._depth -= 1
+        if self._depth:
+            self._after_nested = True
+        else:
+            self._after_nested = False
+            self._end_stage()
+
+    def finish(self) -> None:
+        """
+        Finishes recording plan.
+        """
+        self._end_stage()
+
+    def _end_lane(self) -> None:
+        if self._lane_start is not None:
+            self._lanes.append((self._lane_start, len(self.axes)))
+        self._lane_start = None
+
+    def _end_stage(self) -> None:
+        self._end_lane()
+        if self._lanes:
+            self.stages.append(self._lanes)
+            self.end_states.append(self._state())
+            self._lanes = []
+
+
+def _record_phase(name: str, start: float, seconds: float) -> None:
+    """
+    Records span of phase in metrics and motion trace.
+    """
+    recorder.record(name, start, seconds)
+    if tracer is not None:
+        tracer.phase(name, start, start + seconds)
+
+
+@contextmanager
+def _timed(name: str) -> Iterator[None]:
+    """
+    Records how long the block inside takes as a span of phase, unless it
+    raises an error.
+    """
+    start = clock.perf_counter()
+    yield
+    _record_phase(name, start, clock.perf_counter() - start)
+
+
+def _report(activity: str, **fields: Any) -> None:
     """
-    Establishes motor objects used in stamper.
+    Publishes what chassis is doing as a job progress event.
     """
+    broadcaster.publish(activity, activity=activity, **fields)
+
+
+def _checkpoint(
+    surface: str, character: str, position: int, state: "ChassisState"
+) -> None:
+    """
+    Journals character dipped onto surface, its position in code and where
+    chassis is afterwards, if journal is open.
+    """
+    if journal is not None:
+        kind = (
+            checkpoints.Kinds.PRINTED
+            if surface == Surfaces.FLOOR
+            else checkpoints.Kinds.INKED
+        )
+        journal.record(
+            kind,
+            character,
+            position,
+            state.wheel,
+            state.horizontal,
+            state.vertical,
+        )
+
 
-    STAMPER_WHEEL = stepper.Motor((16, 19, 20, 26))
-    HORIZONTAL_MOVE = stepper.Motor((5, 6, 12, 13))
-    VERTICAL_MOVE = stepper.Motor((17, 22, 23, 27))
+def request_stop(reason: str, cancel: bool = False) -> None:
+    """
+    Halts every motor within a half step. An emergency stop holds stamper
+    stopped until cleared and returns current job to queue. Takes reason as
+    parameter. Optional parameter to only cancel current job instead.
+    """
+    # Latches stop before halting, so the job it interrupts is never taken
+    # for cancelled, and writes it now instead of with the next batch
+    if not cancel:
+        set_cell(Cells.STOP, True)
+        store.flush()
+    engine.halt(reason)
+    print(f"{'Cancelling' if cancel else 'Stopping'}: {reason}")
+    _report("cancelling" if cancel else "stopped", reason=reason, stopped=not cancel)
 
 
-class NumSteps:
+def clear_stop() -> None:
     """
-    A class used by the chassis to measure distances and angles.
+    Clears emergency stop so queued jobs are printed again.
     """
+    set_cell(Cells.STOP, False)
+    store.flush()
+    engine.resume()
+    _report("resumed", reason=None, stopped=False)
 
-    # Heights for vertical movement
-    FLOOR_POSITION = 2552.0
-    INK_POSITION = 2192.0
-    SURFACE_MARGIN = 200.0
-    # Counts for horizontal movement
-    INK_WIDTH = 1100.0
-    CHARACTER_WIDTH = 400.0
-    # Count for character advancement
-    ADVANCE_CHARACTER = 12.5
-    # Maximum positions
-    HORIZONTAL_MAX = 2300.0
-    VERTICAL_MAX = FLOOR_POSITION
+
+def _event_stream(_: dict) -> Iterator[Optional[dict]]:
+    """
+    Streams current state, then each job progress event as it is published.
+    Streams None when nothing happens for a while.
+    """
+    number, state = broadcaster.snapshot()
+    yield {"type": "status", **state}
+    for item in broadcaster.listen(number):
+        yield None if item is None else item[1]
+
+
+def _read_limit(pin: int) -> bool:
+    """
+    Reads limit switch, recording read in motion trace. Returns whether
+    switch is closed.
+    """
+    init_hardware()
+    level = GPIO.input(pin)
+    if tracer is not None:
+        tracer.limit(pin, level, clock.perf_counter())
+    # Switch reads low when closed
+    return not level
+
+
+def _phase(name: str) -> Callable:
+    """
+    Times chassis method as a phase. Records a span each time it runs, or
+    the segments it adds while compiling a plan so they are timed when the
+    plan runs.
+    """
+
+    def decorate(method: Callable) -> Callable:
+        @wraps(method)
+        def timed(self: "Chassis", *args: Any, **kwargs: Any) -> Any:
+            plan = self._plan
+            if plan is None:
+                with _timed(name):
+                    return method(self, *args, **kwargs)
+            first = len(plan)
+            result = method(self, *args, **kwargs)
+            if len(plan) > first:
+                plan.phases.append((name, first, len(plan)))
+            return result
+
+        return timed
+
+    return decorate
 
 
 class Chassis:
@@ -92,11 +559,32 @@ class Chassis:
     """
 
     # Defines default sequence and rpm for movement
-    SEQUENCE = stepper.Sequences.HALFSTEP
-    MOVE_RPM = 80.0
-    WHEEL_RPM = 20.0
-    CHARACTERS = "0123456789ABCDEF"
-    NUM_CHARACTERS = len(CHARACTERS)
+    SEQUENCE = Homing.HALFSTEP_PHASES
+    MOVE_RPM = geometry.MOVE_RPM
+    WHEEL_RPM = geometry.WHEEL_RPM
+    STEPS_PER_REVOLUTION = geometry.STEPS_PER_REVOLUTION
+    # Steps per constant speed piece of a profiled move
+    PROFILE_CHUNK = 8.0
+    CHARACTERS = geometry.CHARACTERS
+    NUM_CHARACTERS = geometry.NUM_CHARACTERS
+    # Half steps between wheel characters and around whole wheel
+    CHARACTER_HALF_STEPS = round(NumSteps.ADVANCE_CHARACTER * 2)
+    WHEEL_HALF_STEPS = CHARACTER_HALF_STEPS * NUM_CHARACTERS
+    # Most distinct characters to try every inking order for
+    MAX_EXACT_ORDERING = 6
+    # Codes to ink for at once, and limits on how long ink stays usable
+    BATCH_SIZE = geometry.BATCH_SIZE
+    INK_MAX_AGE = 120.0
+    INK_MAX_STAMPS = 8
+    # Seconds an axis may wait on another before giving up
+    INTERLOCK_TIMEOUT = 30.0
+    # Compiled print plans kept for reuse
+    PLAN_CACHE_SIZE = 512
+    # Marks code positions printed by another group, and separates groups
+    GAP = "-"
+    GROUP_SEPARATOR = "|"
+    # Longest code to try every grouping of positions for
+    MAX_EXACT_GROUPING = 6
 
     def __init__(self, starting_character: str, zero: bool = True) -> None:
         """
@@ -108,92 +596,306 @@ class Chassis:
             raise ValueError("Starting character must be in hexadecimal.")
         else:
             self.current_character = starting_character.upper()
+        # Tracks wheel in whole half steps so partial steps never add up
+        self.wheel_position = (
+            self._index_of(self.current_character) * self.CHARACTER_HALF_STEPS
+        )
+        # Wheel position when stepping engine had written no half steps, to
+        # find where wheel stopped if a move is halted partway
+        self._wheel_origin = self.wheel_position - engine.position(Pins.STAMPER_WHEEL)
+        # Whether tracked position can be relied on, and why not
+        self.position_trusted = False
+        self.distrust_reason = "not yet zeroed"
+        self.jobs_since_zero = 0
         # Sets current position to max for zeroing
         self.horizontal_position = NumSteps.HORIZONTAL_MAX
         self.vertical_position = NumSteps.VERTICAL_MAX
+        # Guards positions shared between axis threads and signals changes
+        self._lock = RLock()
+        self._moved = Condition(self._lock)
+        # Whether wheel is turning or stamp is being lowered onto a surface
+        self._wheel_turning = False
+        self._lowering = False
+        # Plan being recorded instead of moving motors, if compiling
+        self._plan: Optional[Plan] = None
         # Zeros
         if zero:
             self.zero_vertical()
             self.zero_horizontal()
+            self._trust_position()
 
-    def _index_of(self, character: str) -> int:
+    @classmethod
+    def _index_of(cls, character: str) -> int:
         """
         Finds index of character on wheel.
         """
-        # Checks for invalid character
-        if character.upper() not in self.CHARACTERS:
-            raise ValueError(f"Charater [ {character} ] not on wheel!")
-        # Returns appropriate index
-        return self.CHARACTERS.index(character.upper())
+        return geometry.index_of(character)
+
+    @classmethod
+    def distance(cls, old_character: str, new_character: str) -> int:
+        """
+        Finds signed number of stages between two characters on wheel, taking
+        the shorter way around.
+        """
+        return geometry.distance(old_character, new_character)
+
+    def plan_ink_order(self, code: str, start: Optional[str] = None) -> list[str]:
+        """
+        Orders distinct characters of code for inking so that total wheel
+        travel is smallest. Counts the turn from last inked character to the
+        first printed one. Optional starting character parameter, defaults to
+        current character.
+        """
+        start = (start or self.current_character).upper()
+        code = code.upper()
+        # Each stamp holds its own ink, so characters are inked once
+        characters = list(dict.fromkeys(code))
+
+        def travel(order: tuple[str, ...]) -> int:
+            # Adds up stages turned while inking and on to first print
+            stops = (start,) + order + (code[0],)
+            return sum(
+                abs(self.distance(old, new)) for old, new in zip(stops, stops[1:])
+            )
 
+        # Tries every order when there are few characters
+        if len(characters) <= self.MAX_EXACT_ORDERING:
+            candidates = permutations(characters)
+        # Otherwise sweeps one way around wheel then back the other
+        else:
+            offsets = sorted(
+                characters,
+                key=lambda c: (self._index_of(c) - self._index_of(start))
+                % self.NUM_CHARACTERS,
+            )
+            candidates = []
+            for split in range(len(offsets) + 1):
+                forwards, backwards = offsets[:split], offsets[split:][::-1]
+                candidates.append(tuple(forwards + backwards))
+                candidates.append(tuple(backwards + forwards))
+        # Returns order with least travel
+        return list(min(candidates, key=travel))
+
+    @_phase("advance_character")
     def advance_character_to(self, new_character: str, report: bool = False) -> None:
         """
         Advances wheel from current character to new character. Takes current
         character as input. Optional parameter to report amount moved.
         """
-        # Finds distance between positions
-        character_distance = self._index_of(new_character) - self._index_of(
-            self.current_character
-        )
-        # Checks that character movement is needed
-        if not character_distance:
+        # Finds shortest distance between positions
+        character_distance = self.distance(self.current_character, new_character)
+        target = self._index_of(new_character) * self.CHARACTER_HALF_STEPS
+        # Checks that character movement is needed, as wheel may have been
+        # stopped between characters
+        if not character_distance and self.wheel_position == target:
             if report:
                 print(f'Wheel is already on "{new_character}"!')
             return
-        # Corrects for large distances
-        if abs(character_distance) > self.NUM_CHARACTERS // 2:
-            character_distance -= int(copysign(self.NUM_CHARACTERS, character_distance))
         # Reports amount wheel will advance
         if report:
             # Defines direction name
             direction_name = "forwards" if character_distance > 0 else "backwards"
             # Prints statement
             print(f"Turning wheel {direction_name} {abs(character_distance)} stages!")
-        # Advances
-        self.advance_wheel(character_distance)
+        # Turns from tracked half step to character's exact half step
+        half_steps = (target - self.wheel_position) % self.WHEEL_HALF_STEPS
+        if half_steps > self.WHEEL_HALF_STEPS // 2 or (
+            half_steps == self.WHEEL_HALF_STEPS // 2 and character_distance < 0
+        ):
+            half_steps -= self.WHEEL_HALF_STEPS
+        self._turn_wheel(half_steps)
         # Re-assigns current character
-        self.current_character = new_character
+        with self._lock:
+            self.current_character = new_character.upper()
 
     def advance_wheel(self, character_distance: int = 1, delay: float = 0) -> None:
         """
         Advances wheel one character in specified direction. Takes character
         distance as parameter. Optional delay parameter.
         """
-        # Defines direction from sign
-        direction = int(copysign(1, character_distance))
+        # Without delay, turns all stages in one profiled move
+        if not delay:
+            self._turn_wheel(character_distance * self.CHARACTER_HALF_STEPS)
+            return
         # For each stage:
         for _ in range(abs(character_distance)):
             # Advances wheel one character in direction
-            stepper.step_motor(
-                motor=Motors.STAMPER_WHEEL,
-                num_steps=NumSteps.ADVANCE_CHARACTER,
-                direction=direction,
-                sequence=self.SEQUENCE,
-                rpm=self.WHEEL_RPM,
+            self._turn_wheel(
+                int(copysign(self.CHARACTER_HALF_STEPS, character_distance))
             )
-            time.sleep(delay)
+            self._dwell(delay)
+
+    def _turn_wheel(self, half_steps: int) -> None:
+        """
+        Turns wheel by whole number of half steps, signed by direction, and
+        updates tracked wheel position.
+        """
+        if not half_steps:
+            return
+        # Waits until stamp is clear of every surface
+        self._claim(wheel=True)
+        try:
+            self._drive(
+                Axes.WHEEL,
+                abs(half_steps) / 2,
+                int(copysign(1, half_steps)),
+                Profiles.WHEEL,
+            )
+            with self._lock:
+                self.wheel_position = (
+                    self.wheel_position + half_steps
+                ) % self.WHEEL_HALF_STEPS
+        finally:
+            self._release(wheel=True)
+
+    def _drive(
+        self,
+        axis: int,
+        num_steps: float,
+        direction: int,
+        profile: Profile,
+        rpm: Optional[float] = None,
+    ) -> float:
+        """
+        Steps motor of axis following speed profile, or at a constant speed if
+        RPM is given. Returns number of steps taken.
+        """
+        pieces = [(num_steps, rpm)] if rpm else self.ramp(num_steps, profile)
+        # Records pieces instead of stepping while compiling a plan
+        if self._plan is not None:
+            for piece_steps, piece_rpm in pieces:
+                self._plan.add(axis, piece_steps, direction, piece_rpm)
+            return float(num_steps)
+        return engine.run(_AXIS_PINS[axis], pieces, direction)
+
+    def _dwell(self, seconds: float) -> None:
+        """
+        Pauses with no motor moving, or records pause while compiling a plan.
+        """
+        if self._plan is not None:
+            self._plan.add(Axes.DWELL, 0.0, 0, 0.0, seconds)
+        elif seconds:
+            engine.pause(seconds)
+
+    def _mark(self, message: str) -> None:
+        """
+        Reports progress message, or records it while compiling a plan.
+        """
+        if self._plan is not None:
+            self._plan.mark(message)
+        else:
+            print(message)
+
+    def _record_dip(self, surface: str, character: str) -> None:
+        """
+        Records dip of character onto surface while compiling a plan.
+        """
+        if self._plan is not None:
+            self._plan.dip(surface, character)
+
+    @classmethod
+    def ramp(cls, num_steps: float, profile: Profile) -> list[tuple[float, float]]:
+        """
+        Splits move into pieces of constant speed that speed up from start,
+        cruise, and slow down to a stop within profile limits. Returns list of
+        steps and RPM for each piece.
+        """
+        distances, speeds = _speed_curve(profile, cls.STEPS_PER_REVOLUTION)
+        pieces: list[tuple[float, float]] = []
+        position = 0.0
+        while position < num_steps:
+            piece_steps = min(cls.PROFILE_CHUNK, num_steps - position)
+            # Takes speed at middle of piece from nearer end of move
+            middle = position + piece_steps / 2
+            from_end = min(middle, num_steps - middle)
+            index = bisect_left(distances, from_end)
+            rpm = speeds[index] if index < len(speeds) else profile.max_rpm
+            # Joins pieces of equal speed
+            if pieces and pieces[-1][1] == rpm:
+                pieces[-1] = (pieces[-1][0] + piece_steps, rpm)
+            else:
+                pieces.append((piece_steps, rpm))
+            position += piece_steps
+        return pieces
 
+    @staticmethod
+    def _touches(horizontal_position: float, vertical_position: float) -> bool:
+        """
+        Checks whether stamp touches ink pad or floor at given position.
+        """
+        # Ink pad lies below the first ink width, floor everywhere else
+        surface = (
+            NumSteps.INK_POSITION
+            if horizontal_position < NumSteps.INK_WIDTH
+            else NumSteps.FLOOR_POSITION
+        )
+        return vertical_position > surface - NumSteps.CONTACT_CLEARANCE
+
+    def _in_contact(self, vertical_position: Optional[float] = None) -> bool:
+        """
+        Checks whether stamp touches ink pad or floor at current or given
+        vertical position.
+        """
+        with self._lock:
+            if vertical_position is None:
+                vertical_position = self.vertical_position
+            return self._touches(self.horizontal_position, vertical_position)
+
+    def _claim(self, wheel: bool = False, lowering: bool = False) -> None:
+        """
+        Waits until wheel may turn or stamp may be lowered onto a surface, then
+        marks that move as under way. Raises error if it does not become safe
+        in time.
+        """
+        # Compiled plans are checked for safety as a whole instead
+        if self._plan is not None:
+            return
+        with self._moved:
+            # Wheel must not turn while stamp is on or being lowered to a
+            # surface, and stamp must not be lowered while wheel turns
+            if wheel:
+                safe = lambda: not self._lowering and not self._in_contact()
+                message = "Wheel cannot turn while stamp is on a surface!"
+            else:
+                safe = lambda: not self._wheel_turning
+                message = "Stamp cannot be lowered while wheel is turning!"
+            if not self._moved.wait_for(safe, self.INTERLOCK_TIMEOUT):
+                raise RuntimeError(message)
+            self._wheel_turning = self._wheel_turning or wheel
+            self._lowering = self._lowering or lowering
+
+    def _release(self, wheel: bool = False, lowering: bool = False) -> None:
+        """
+        Clears moving flags and wakes axes waiting on them.
+        """
+        with self._moved:
+            if wheel:
+                self._wheel_turning = False
+            if lowering:
+                self._lowering = False
+            self._moved.notify_all()
+
+    @_phase("move_horizontal")
     def move_horizontal(
-        self, num_steps: float, direction: int, rpm: float = MOVE_RPM
+        self, num_steps: float, direction: int, rpm: Optional[float] = None
     ) -> float:
         """
         Moves slider horizontally on lead screw. Takes number of steps and
-        direction as parameters. Optional RPM parameter.
+        direction as parameters. Optional constant RPM parameter, otherwise
+        follows horizontal profile.
         """
         # Defines number of steps moving to the right
         steps_right = num_steps * direction * Directions.RIGHT
         # If steps to the right would not exceed minimum or maximum:
         if 0 <= self.horizontal_position + steps_right <= NumSteps.HORIZONTAL_MAX:
             # Steps in direction
-            steps_taken = stepper.step_motor(
-                Motors.HORIZONTAL_MOVE,
-                num_steps,
-                direction,
-                self.SEQUENCE,
-                rpm,
+            steps_taken = self._drive(
+                Axes.HORIZONTAL, num_steps, direction, Profiles.HORIZONTAL, rpm
             )
             # Addes to current position
-            self.horizontal_position += steps_taken
+            with self._moved:
+                self.horizontal_position += copysign(steps_taken, steps_right)
+                self._moved.notify_all()
         else:
             # Reports invalid movement
             raise ValueError(
@@ -203,26 +905,33 @@ class Chassis:
         return steps_taken
 
     def move_vertical(
-        self, num_steps: float, direction: int, rpm: float = MOVE_RPM
+        self, num_steps: float, direction: int, rpm: Optional[float] = None
     ) -> float:
         """
         Moves chassis vertically on lead screws. Takes number of steps and
-        direction as parameters. Optional RPM parameter.
+        direction as parameters. Optional constant RPM parameter, otherwise
+        follows vertical profile.
         """
         # Defines number of positive steps moving to the right
         steps_down = num_steps * direction * Directions.DOWN
         # If steps to the right would not exceed minumum or maximum:
         if 0 < self.vertical_position + steps_down <= NumSteps.VERTICAL_MAX:
-            # Steps in direction
-            steps_taken = stepper.step_motor(
-                Motors.VERTICAL_MOVE,
-                num_steps,
-                direction,
-                self.SEQUENCE,
-                rpm,
+            # If lowering onto a surface, waits for wheel to stop first
+            lowering = steps_down > 0 and self._in_contact(
+                self.vertical_position + steps_down
             )
-            # Addes to current position
-            self.vertical_position += steps_taken
+            if lowering:
+                self._claim(lowering=True)
+            try:
+                # Steps in direction
+                steps_taken = self._drive(
+                    Axes.VERTICAL, num_steps, direction, Profiles.VERTICAL, rpm
+                )
+                # Addes to current position
+                with self._moved:
+                    self.vertical_position += copysign(steps_taken, steps_down)
+            finally:
+                self._release(lowering=lowering)
         else:
             # Reports invalid movement
             raise ValueError(
@@ -231,38 +940,49 @@ class Chassis:
         # Returns number of steps taken
         return steps_taken
 
-    def move_horizontal_to(self, step_position: float, rpm: float = MOVE_RPM) -> float:
+    def move_horizontal_to(
+        self, step_position: float, rpm: Optional[float] = None
+    ) -> float:
         """
         Moves slider horizontally on lead screw to desired step position. Takes
         horizontal step position as parameter. Optional RPM parameter.
         """
-        # If position is zero:
-        if not step_position:
+        # If position is zero and tracked position is not trusted:
+        if not step_position and not self.position_trusted:
             # Zeros horizontally
             return self.zero_horizontal()
         # Moves difference between new and current position and returns steps taken
+        steps_right = step_position - self.horizontal_position
+        if not steps_right:
+            return 0.0
         return self.move_horizontal(
-            step_position - self.horizontal_position,
-            Directions.RIGHT,
+            abs(steps_right),
+            Directions.RIGHT if steps_right > 0 else Directions.LEFT,
             rpm,
         )
 
-    def move_vertical_to(self, step_position: float, rpm: float = MOVE_RPM) -> float:
+    def move_vertical_to(
+        self, step_position: float, rpm: Optional[float] = None
+    ) -> float:
         """
         Moves slider vertically on lead screw to desired step position. Takes
         vertical step position as parameter. Optional RPM parameter.
         """
-        # If position is zero:
-        if not step_position:
+        # If position is zero and tracked position is not trusted:
+        if not step_position and not self.position_trusted:
             # Zeros horizontally
             return self.zero_vertical()
         # Moves difference between new and current position and returns steps taken
-        return self.move_horizontal(
-            step_position - self.horizontal_position,
-            Directions.DOWN,
+        steps_down = step_position - self.vertical_position
+        if not steps_down:
+            return 0.0
+        return self.move_vertical(
+            abs(steps_down),
+            Directions.DOWN if steps_down > 0 else Directions.UP,
             rpm,
         )
 
+    @_phase("zero_horizontal")
     def zero_horizontal(self) -> float:
         """
         Zeroes horizontal movement against side limit switch. Returns steps
@@ -271,16 +991,19 @@ class Chassis:
         print("Zeroing horizontally. . .")
         # Runs zeroing function
         steps_taken = self._zero(
-            self.move_horizontal,
+            Pins.HORIZONTAL_MOVE,
             Directions.LEFT,
             Pins.HORIZONTAL_LIMIT,
             self.horizontal_position,
         )
         # Sets position to zero
-        self.horizontal_position = 0
+        with self._moved:
+            self.horizontal_position = 0
+            self._moved.notify_all()
         # Returns original horizontal position
         return steps_taken
 
+    @_phase("zero_vertical")
     def zero_vertical(self) -> float:
         """
         Zeroes vertical movement against top limit switch. Returns steps
@@ -289,42 +1012,78 @@ class Chassis:
         print("Zeroing vertically. . .")
         # Runs zeroing function
         steps_taken = self._zero(
-            self.move_vertical,
+            Pins.VERTICAL_MOVE,
             Directions.UP,
             Pins.VERTICAL_LIMIT,
             self.vertical_position,
         )
         # Sets position to zero
-        self.vertical_position = 0
+        with self._moved:
+            self.vertical_position = 0
+            self._moved.notify_all()
         # Returns original vertial position
         return steps_taken
 
     def _zero(
         self,
-        move_function: Callable[[float, int], float],
+        coil_pins: tuple[int, ...],
         direction: int,
         limit_pin: int,
         position_guess: float,
     ) -> float:
         """
-        Zeroes movement against specified limit switch. Takes moving function,
-        direction, and limit switch pin as paramters. Returns steps taken
-        before stopping.
-        """
-        # Defines variables for loop
-        STEP_BUFFER = 400
-        STEP_INTERVAL = 4
-        steps_taken = 0.0
-        # While pin is not active and number of steps is under position guess
-        # plus max:
-        while (
-            GPIO.input(limit_pin)  # type:ignore
-            and steps_taken < position_guess + STEP_BUFFER
-        ):
-            # Moves number of steps
-            move_function(STEP_INTERVAL, direction)
-            # Adds steps taken
-            steps_taken += STEP_INTERVAL
+        Zeroes movement against specified limit switch. Takes motor coil pins,
+        direction, and limit switch pin as paramters. Streams steps quickly
+        until the switch is hit, then backs off and approaches again slowly.
+        Returns steps taken towards switch before stopping. Raises HomingFault
+        if either approach ends without reaching switch.
+        """
+        init_hardware()
+        # Stops streaming as soon as switch closes
+        hit = Event()
+
+        def closed(pin: int) -> None:
+            hit.set()
+            if tracer is not None:
+                tracer.limit(pin, GPIO.LOW, clock.perf_counter())  # type: ignore
+
+        GPIO.add_event_detect(limit_pin, GPIO.FALLING, callback=closed)  # type: ignore
+        try:
+            # Approaches quickly unless switch is already closed
+            steps_taken = 0.0
+            if not _read_limit(limit_pin):
+                steps_taken = engine.run(
+                    coil_pins,
+                    [(position_guess + Homing.STEP_BUFFER, Homing.FAST_RPM)],
+                    direction,
+                    hit,
+                )
+                if not hit.is_set():
+                    raise HomingFault(
+                        f"Limit switch on pin {limit_pin} not reached after "
+                        f"{steps_taken:.0f} steps!"
+                    )
+            # Backs off switch
+            steps_taken -= engine.run(
+                coil_pins, [(Homing.BACK_OFF, self.MOVE_RPM)], -direction
+            )
+            if _read_limit(limit_pin):
+                raise HomingFault(
+                    f"Limit switch on pin {limit_pin} still closed after "
+                    "backing off!"
+                )
+            # Approaches again slowly
+            hit.clear()
+            steps_taken += engine.run(
+                coil_pins, [(Homing.BACK_OFF * 2, Homing.SLOW_RPM)], direction, hit
+            )
+            if not hit.is_set():
+                raise HomingFault(
+                    f"Limit switch on pin {limit_pin} not reached again after "
+                    "backing off!"
+                )
+        finally:
+            GPIO.remove_event_detect(limit_pin)  # type: ignore
         # Returns total steps taken before stopping
         return steps_taken
 
@@ -332,25 +1091,144 @@ class Chassis:
         """
         Zeros in both axes at the same time.
         """
-        # Creates threads
-        horizontal_thread = Thread(target=self.zero_horizontal)
-        vertical_thread = Thread(target=self.zero_vertical)
-        # Starts threads
-        horizontal_thread.start()
-        vertical_thread.start()
-        # Waits until both threads are finished
-        horizontal_thread.join()
-        vertical_thread.join()
+        self.concurrently(self.zero_horizontal, self.zero_vertical)
+        self._trust_position()
+
+    def _trust_position(self) -> None:
+        """
+        Marks tracked position as reliable after zeroing both axes.
+        """
+        self.position_trusted = True
+        self.distrust_reason = ""
+        self.jobs_since_zero = 0
+
+    def distrust_position(self, reason: str) -> None:
+        """
+        Marks tracked position as unreliable so next job zeros first. Takes
+        reason as parameter.
+        """
+        self.position_trusted = False
+        self.distrust_reason = reason
+
+    def stopped(self, reason: str) -> None:
+        """
+        Marks tracked position as unreliable after moves were halted partway,
+        and finds where wheel stopped from half steps written to it. Takes
+        reason as parameter.
+        """
+        self.distrust_position(reason)
+        self.assume_wheel_position(
+            self._wheel_origin + engine.position(Pins.STAMPER_WHEEL)
+        )
+
+    def assume_wheel_position(self, half_steps: int) -> None:
+        """
+        Sets tracked wheel position, and current character to the nearest one,
+        which wheel returns to exactly when next turned. Takes wheel position
+        in half steps as parameter.
+        """
+        with self._moved:
+            self.wheel_position = half_steps % self.WHEEL_HALF_STEPS
+            self._wheel_origin = self.wheel_position - engine.position(
+                Pins.STAMPER_WHEEL
+            )
+            index = round(self.wheel_position / self.CHARACTER_HALF_STEPS)
+            self.current_character = self.CHARACTERS[index % self.NUM_CHARACTERS]
+            self._moved.notify_all()
+
+    def zero_if_needed(self) -> bool:
+        """
+        Zeros both axes only if tracked position is untrusted, routine zeroing
+        is due, or a limit switch disagrees with tracked position. Returns
+        whether chassis was zeroed.
+        """
+        if not self.position_trusted:
+            reason = self.distrust_reason
+        elif self.jobs_since_zero >= Rehoming.EVERY_JOBS:
+            reason = f"{self.jobs_since_zero} jobs since last zero"
+        elif self._drifted():
+            reason = "limit switch disagrees with tracked position"
+        else:
+            return False
+        print(f"Zeroing ({reason}). . .")
+        _report("zeroing", reason=reason)
+        self.zero_simultaneous()
+        return True
+
+    def _drifted(self) -> bool:
+        """
+        Checks limit switches against tracked position. A switch closed far
+        from zero, or open at zero, means position has drifted.
+        """
+        with self._lock:
+            for position, pin in (
+                (self.horizontal_position, Pins.HORIZONTAL_LIMIT),
+                (self.vertical_position, Pins.VERTICAL_LIMIT),
+            ):
+                closed = _read_limit(pin)
+                if closed and position > Rehoming.DRIFT_TOLERANCE:
+                    return True
+                if not closed and position <= 0:
+                    return True
+        return False
+
+    def concurrently(self, *moves: Optional[Callable[[], Any]]) -> None:
+        """
+        Runs moves of separate axes at the same time and waits until all are
+        finished. Moves that are None are skipped. Raises first error from
+        any move.
+        """
+        # Records moves as lanes of one stage while compiling a plan
+        if self._plan is not None:
+            self._plan.begin_parallel()
+            for move in moves:
+                if move:
+                    self._plan.next_lane()
+                    move()
+            self._plan.end_parallel()
+            return
+        # Simulator runs moves one after another from the same start time,
+        # then jumps to when the last one finished
+        if SIMULATED:
+            start, finish = clock.perf_counter(), clock.perf_counter()
+            for move in moves:
+                if move:
+                    clock.set(start)
+                    move()
+                    finish = max(finish, clock.perf_counter())
+            clock.set(finish)
+            return
+        errors: list[BaseException] = []
 
+        def run(move: Callable[[], Any]) -> None:
+            try:
+                move()
+            except BaseException as error:
+                errors.append(error)
+
+        # Creates and starts a thread for each move
+        threads = [Thread(target=run, args=(move,)) for move in moves if move]
+        for thread in threads:
+            thread.start()
+        # Waits until all threads are finished
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    @_phase("dip")
     def dip(
         self,
         num_steps: float,
         slow_step_fraction: float = 0.5,
         slow_rpm_fraction: float = 0.3,
+        while_rising: Optional[Callable[[], Any]] = None,
     ) -> None:
         """
         Moves chassis down and then up. Takes number of steps as parameter.
         Optional slowed number of steps fraction and slowed speed parameters.
+        Optional move to run alongside the fast part of the rise, once stamp
+        is clear of the surface.
         """
         # Calculates new number of steps and rpm for bottom margin
         slow_num_steps = num_steps * slow_step_fraction
@@ -358,37 +1236,47 @@ class Chassis:
         # Moves down and up with a slower bottom portion
         self.move_vertical(num_steps - slow_num_steps, Directions.DOWN)
         self.move_vertical(slow_num_steps, Directions.DOWN, slow_rpm)
-        time.sleep(0.5)
+        self._dwell(0.5)
         self.move_vertical(slow_num_steps, Directions.UP, slow_rpm)
-        self.move_vertical(num_steps - slow_num_steps, Directions.UP)
+        self.concurrently(
+            lambda: self.move_vertical(num_steps - slow_num_steps, Directions.UP),
+            while_rising,
+        )
 
     def print_slow(self, code: str) -> None:
         """
         Runs main stamper actions, inking between all characters.
         """
-        # Zeros out horizontal
-        print("Zeroing. . .")
-        self.zero_simultaneous()
-        self.move_vertical(
-            NumSteps.INK_POSITION - NumSteps.SURFACE_MARGIN, Directions.DOWN
-        )
+        with _timed("job"):
+            # Zeros out if tracked position cannot be trusted
+            self.zero_if_needed()
+            self.execute("slow", code)
+        self.jobs_since_zero += 1
+
+    def _print_slow_moves(self, code: str) -> None:
+        """
+        Moves for printing code slowly, inking before each character.
+        """
+        self._move_over_ink()
         # Defines starting character
         prev_character = STARTING_CHARACTER
         # For each character in code:
         for index, character in enumerate(code):
             # Reports character
-            print(f"Stamping: [ {character} ]...")
+            self._mark(f"Stamping: [ {character} ]...")
             # Moves wheel to character
             self.advance_character_to(character)
             # Re-inks if nessesary
             if not (character == prev_character and index):
-                print("Re-inking. . .")
-                # Zeros out and records steps
-                steps_taken = self.zero_horizontal()
+                self._mark("Re-inking. . .")
+                # Moves over ink pad and records steps
+                steps_taken = self.horizontal_position
+                self.move_horizontal_to(0)
                 # Dips to pad
+                self._record_dip(Surfaces.INK, character)
                 self.dip(NumSteps.SURFACE_MARGIN)
                 # Moves back to original position
-                self.move_horizontal(steps_taken, Directions.RIGHT)
+                self.move_horizontal_to(steps_taken)
             # Sets previous character to character
             prev_character = character
             # Defines shift amount with exception for first loop
@@ -396,6 +1284,7 @@ class Chassis:
             # Shifts to next position
             self.move_horizontal(horizontal_shift, Directions.RIGHT)
             # Dips chassis to floor
+            self._record_dip(Surfaces.FLOOR, character)
             self.dip(
                 NumSteps.FLOOR_POSITION
                 - NumSteps.INK_POSITION
@@ -403,82 +1292,1116 @@ class Chassis:
                 slow_step_fraction=0.25,
             )
 
-    def print_fast(self, code: str) -> None:
+    def ink(self, code: str) -> None:
         """
-        Runs main stamper actions, inking all characters once at start.
+        Moves over ink pad and inks each distinct character of code once, in
+        order of least wheel travel. Gaps in code are ignored.
+        """
+        order = "".join(self.plan_ink_order(code.replace(self.GAP, "")))
+        # Lifts clear of ink pad and moves over it while turning to first
+        # character
+        self.concurrently(
+            self._move_over_ink, lambda: self.advance_character_to(order[0])
+        )
+        # For each distinct character, in order of least wheel travel:
+        for index, character in enumerate(order):
+            self._mark(f"Inking: [ {character} ]...")
+            self._record_dip(Surfaces.INK, character)
+            # Inks, turning to next character while rising
+            self.dip(
+                NumSteps.SURFACE_MARGIN,
+                while_rising=self._turning_to(order[index + 1 : index + 2]),
+            )
+
+    def print_code(self, code: str) -> None:
+        """
+        Moves to first floor position and prints each character of code.
+        Characters must already be inked. Positions of code that are gaps are
+        skipped, so a code can be printed in groups.
+        """
+        positions = [
+            index for index, character in enumerate(code) if character != self.GAP
+        ]
+        # Moves ready to print while turning to first character
+        self.concurrently(
+            lambda: self._move_over_floor(positions[0]),
+            lambda: self.advance_character_to(code[positions[0]]),
+        )
+        # For each character, with position of the one printed after it
+        for position, following in zip(positions, positions[1:] + [len(code)]):
+            character = code[position]
+            self._mark(f"Printing: [ {character} ]...")
+            self._record_dip(Surfaces.FLOOR, character)
+            # Prints, then shifts to next floor position and turns to next
+            # character while rising
+            self.dip(
+                NumSteps.SURFACE_MARGIN,
+                while_rising=self._shifting_to(
+                    code[following : following + 1], following - position
+                ),
+            )
+
+    def _print_group_moves(self, layout: str) -> None:
+        """
+        Moves for printing code in groups of positions, inking each group's
+        characters just before printing them. Takes layout of groups, each a
+        copy of code with positions of other groups as gaps, separated by the
+        group separator.
+        """
+        for group in layout.split(self.GROUP_SEPARATOR):
+            self.ink(group)
+            self.print_code(group)
+
+    def _turning_to(self, character: str) -> Optional[Callable[[], None]]:
+        """
+        Returns move that turns wheel to character, or None if there is no
+        character.
+        """
+        if not character:
+            return None
+        return lambda: self.advance_character_to(character)
+
+    def _shifting_to(
+        self, character: str, positions: int = 1
+    ) -> Optional[Callable[[], None]]:
+        """
+        Returns move that shifts along floor positions while turning wheel to
+        character, or None if there is no character. Optional number of
+        positions parameter.
+        """
+        if not character:
+            return None
+        return lambda: self.concurrently(
+            lambda: self.move_horizontal(
+                NumSteps.CHARACTER_WIDTH * positions, Directions.RIGHT
+            ),
+            self._turning_to(character),
+        )
+
+    def _move_over_ink(self) -> None:
+        """
+        Lifts clear of ink pad and moves over it.
         """
-        # Zeros out horizontal
-        self.zero_simultaneous()
-        # Moves ready to ink
         self.move_vertical_to(NumSteps.INK_POSITION - NumSteps.SURFACE_MARGIN)
-        # For each character:
-        for character in code:
-            print(f"Inking: [ {character} ]...")
-            # Advances to character, inks and waits
-            self.advance_character_to(character)
-            # Inks
-            self.dip(NumSteps.SURFACE_MARGIN)
-        # Moves away from ink pad
-        self.move_horizontal(NumSteps.INK_WIDTH, Directions.RIGHT)
-        # Moves ready to print
+        if self.horizontal_position:
+            self.move_horizontal(self.horizontal_position, Directions.LEFT)
+
+    def _move_over_floor(self, position: int = 0) -> None:
+        """
+        Moves away from ink pad and lowers ready to print. Optional floor
+        position parameter.
+        """
+        self.move_horizontal_to(
+            NumSteps.INK_WIDTH + NumSteps.CHARACTER_WIDTH * position
+        )
         self.move_vertical_to(NumSteps.FLOOR_POSITION - NumSteps.SURFACE_MARGIN)
-        # For each character
-        for index, character in enumerate(code):
-            print(f"Printing: [ {character} ]...")
-            # If not first loop:
-            if index:
-                # Shift to next floor posiiton
-                self.move_horizontal(NumSteps.CHARACTER_WIDTH, Directions.RIGHT)
-            # Advances to character
-            self.advance_character_to(character)
-            # Prints
-            self.dip(NumSteps.SURFACE_MARGIN)
+
+    def state(self) -> ChassisState:
+        """
+        Returns tracked chassis position.
+        """
+        with self._lock:
+            return ChassisState(
+                self.current_character,
+                self.wheel_position,
+                self.horizontal_position,
+                self.vertical_position,
+            )
+
+    def _set_state(self, state: ChassisState) -> None:
+        """
+        Sets tracked chassis position.
+        """
+        with self._moved:
+            (
+                self.current_character,
+                self.wheel_position,
+                self.horizontal_position,
+                self.vertical_position,
+            ) = state
+            self._moved.notify_all()
+
+    def execute(self, action: str, code: str) -> None:
+        """
+        Runs print action for code from current position, compiling its plan
+        only if it is not already cached. Takes action of "ink", "print",
+        "slow" or "groups" and code, or layout of groups, as parameters.
+        """
+        self.run_plan(compile_plan(action, code.upper(), self.state()))
+
+    def run_plan(self, plan: Plan) -> None:
+        """
+        Runs compiled plan stage by stage, running lanes of a stage at the
+        same time. Plan must start from current position. Records spans of
+        timed phases once plan has run.
+        """
+        if self.state() != plan.start:
+            raise ValueError("Plan was compiled for a different chassis position!")
+        # When each segment started and finished
+        times = (array("d", bytes(8 * len(plan))), array("d", bytes(8 * len(plan))))
+        # Characters dipped in each stage, to report as it starts
+        dips: dict[int, list[tuple[str, str]]] = {}
+        for stage, surface, character in plan.dips:
+            dips.setdefault(stage, []).append((surface, character))
+        # Dips by stage they first touch their surface in, checkpointed as
+        # soon as that stage finishes so a stamped position is never missed
+        contacts = _contact_stages(plan)
+        for stage, lanes in enumerate(plan.stages):
+            for message in plan.marks.get(stage, ()):
+                print(message)
+            for surface, character in dips.get(stage, ()):
+                _report(_DIP_ACTIVITIES[surface], character=character)
+            if len(lanes) == 1:
+                self._run_lane(plan, *lanes[0], times)
+            else:
+                self.concurrently(
+                    *(
+                        partial(self._run_lane, plan, start, end, times)
+                        for start, end in lanes
+                    )
+                )
+            # Tracks position after every stage in case a later one fails
+            self._set_state(plan.end_states[stage])
+            for surface, character, position in contacts.get(stage, ()):
+                _checkpoint(surface, character, position, plan.end_states[stage])
+        # Phase runs from its first segment starting to its last finishing
+        starts, ends = times
+        for name, first, end in plan.phases:
+            start = min(starts[first:end])
+            _record_phase(name, start, max(ends[first:end]) - start)
+
+    def _run_lane(
+        self, plan: Plan, start: int, end: int, times: tuple[array, array]
+    ) -> None:
+        """
+        Steps through segments of one lane of plan. Hands consecutive segments
+        of one motor to stepping engine as a single move so it never pauses
+        between them. Records when each segment started and finished.
+        """
+        axes, steps, directions = plan.axes, plan.steps, plan.directions
+        rpms, dwells = plan.rpms, plan.dwells
+        starts, ends = times
+        index = start
+        while index < end:
+            axis, direction = axes[index], directions[index]
+            first, began = index, clock.perf_counter()
+            if axis == Axes.DWELL:
+                engine.pause(dwells[index])
+                index += 1
+            else:
+                # Gathers pieces until axis or direction changes
+                pieces = []
+                while (
+                    index < end
+                    and axes[index] == axis
+                    and directions[index] == direction
+                ):
+                    pieces.append((steps[index], rpms[index]))
+                    index += 1
+                engine.run(_AXIS_PINS[axis], pieces, direction)
+            finished = clock.perf_counter()
+            for segment in range(first, index):
+                starts[segment], ends[segment] = began, finished
+
+    def print_fast(self, code: str) -> None:
+        """
+        Runs main stamper actions, inking all characters once at start.
+        """
+        with _timed("job"):
+            # Zeros out if tracked position cannot be trusted
+            self.zero_if_needed()
+            # Inks each character needed
+            self.execute("ink", code)
+            # Prints code
+            self.execute("print", code)
+        self.jobs_since_zero += 1
+
+    def print_adaptive(
+        self,
+        code: str,
+        max_ink_age: float = INK_MAX_AGE,
+        max_ink_stamps: int = INK_MAX_STAMPS,
+    ) -> None:
+        """
+        Prints code with whichever of print_slow(), print_fast() or a hybrid
+        of them is quickest while keeping ink fresh. Optional maximum ink age
+        and stamps per inking parameters.
+        """
+        with _timed("job"):
+            # Zeros out if tracked position cannot be trusted
+            self.zero_if_needed()
+            action, layout = choose_strategy(
+                code.upper(), self.state(), max_ink_age, max_ink_stamps
+            )
+            print(
+                f"Printing {code.upper()} as: {layout if action == 'groups' else action}"
+            )
+            self.execute(action, layout)
+        self.jobs_since_zero += 1
+
+    def print_batch(
+        self,
+        codes: list[str],
+        on_printed: Optional[Callable[[str], None]] = None,
+        batch_size: int = BATCH_SIZE,
+        max_ink_age: float = INK_MAX_AGE,
+        max_ink_stamps: int = INK_MAX_STAMPS,
+    ) -> None:
+        """
+        Prints several codes one after another without zeroing between them
+        unless needed. Inks every character needed by as many of the next codes
+        as ink stays fresh for in one pass, and only re-inks when a character
+        of the next code is missing, older than the maximum ink age, or has
+        made the maximum number of stamps. Each time it would re-ink, prints
+        the next code on its own with the plan print_adaptive() would pick
+        instead if that is quicker per code. Positions of codes that are gaps
+        are skipped. Optional callback parameter, called with each code once
+        printed.
+        """
+        codes = [code.upper() for code in codes]
+        # Records when each character was inked and stamps made since
+        inked_at: dict[str, float] = {}
+        stamps: dict[str, int] = {}
+        for index, code in enumerate(codes):
+            with _timed("job"):
+                # Zeros out if tracked position cannot be trusted
+                self.zero_if_needed()
+                now = clock.monotonic()
+                # Checks ink of every character in code is fresh
+                stale = any(
+                    character not in inked_at
+                    or now - inked_at[character] > max_ink_age
+                    or stamps[character] + code.count(character) > max_ink_stamps
+                    for character in set(code) - {self.GAP}
+                )
+                alone = None
+                if stale:
+                    upcoming = codes[index : index + batch_size]
+                    alone = choose_batch_strategy(
+                        tuple(upcoming), self.state(), max_ink_age, max_ink_stamps
+                    )
+                if alone is not None:
+                    # Prints code with its own inking, leaving batch ink stale
+                    action, layout = alone
+                    print(
+                        f"Printing {code} on its own as: "
+                        f"{layout if action == 'groups' else action}"
+                    )
+                    self.execute(action, layout)
+                else:
+                    if stale:
+                        # Inks every character needed by as many upcoming
+                        # codes as ink stays fresh for
+                        count, _ = ink_window(
+                            tuple(upcoming), self.state(), max_ink_age, max_ink_stamps
+                        )
+                        upcoming = upcoming[:count]
+                        print(f"Inking for {count} codes...")
+                        self.execute("ink", "".join(upcoming))
+                        inked_at = dict.fromkeys("".join(upcoming), now)
+                        stamps = dict.fromkeys("".join(upcoming), 0)
+                    # Prints code and counts stamps
+                    print(f"Printing code: {code}")
+                    self.execute("print", code)
+                    for character in code.replace(self.GAP, ""):
+                        stamps[character] += 1
+            self.jobs_since_zero += 1
+            if on_printed is not None:
+                on_printed(code)
+
+
+# Progress reported for dips onto each surface
+_DIP_ACTIVITIES = {Surfaces.INK: "inking", Surfaces.FLOOR: "printing"}
+
+# Chassis method recording each plan action
+_PLAN_ACTIONS = {
+    "ink": "ink",
+    "print": "print_code",
+    "slow": "_print_slow_moves",
+    "groups": "_print_group_moves",
+}
+
+
+@lru_cache(maxsize=Chassis.PLAN_CACHE_SIZE)
+def compile_plan(action: str, code: str, start: ChassisState) -> Plan:
+    """
+    Compiles print action for code from start state into a plan of motor
+    segments. Moves are checked against position limits as they are recorded
+    and the plan is checked against the wheel interlock once. Plans are cached
+    so repeated codes skip planning.
+    """
+    if action not in _PLAN_ACTIONS:
+        raise ValueError(f"Unknown plan action: {action}")
+    # Records moves of a chassis that starts where the real one is
+    chassis = Chassis(start.character, zero=False)
+    chassis._set_state(start)
+    chassis.position_trusted = True
+    chassis._plan = plan = Plan(start, chassis.state)
+    getattr(chassis, _PLAN_ACTIONS[action])(code)
+    plan.finish()
+    _check_interlock(plan)
+    return plan
+
+
+def _contact_stages(plan: Plan) -> dict[int, list[tuple[str, str, int]]]:
+    """
+    Finds stage in which each dip of plan first touches its surface. Returns
+    surface, character and position of code of dips by that stage.
+    """
+    contacts: dict[int, list[tuple[str, str, int]]] = {}
+    for first, surface, character in plan.dips:
+        for stage in range(first, len(plan.stages)):
+            horizontal = _stage_contact(plan, stage)
+            if horizontal is not None:
+                contacts.setdefault(stage, []).append(
+                    (surface, character, _code_position(surface, horizontal))
+                )
+                break
+    return contacts
+
+
+def _stage_contact(plan: Plan, stage: int) -> Optional[float]:
+    """
+    Follows lanes of stage of plan from state before it. Returns horizontal
+    position at which stamp first touches a surface, or None if it does not.
+    """
+    state = plan.end_states[stage - 1] if stage else plan.start
+    for start, end in plan.stages[stage]:
+        horizontal, vertical = state.horizontal, state.vertical
+        for index in range(start, end):
+            steps = plan.steps[index] * plan.directions[index]
+            if plan.axes[index] == Axes.HORIZONTAL:
+                horizontal += steps * Directions.RIGHT
+            elif plan.axes[index] == Axes.VERTICAL:
+                vertical += steps * Directions.DOWN
+            if Chassis._touches(horizontal, vertical):
+                return horizontal
+    return None
+
+
+def _code_position(surface: str, horizontal_position: float) -> int:
+    """
+    Returns position of code that stamp is over at horizontal position, if
+    surface is floor.
+    """
+    if surface != Surfaces.FLOOR:
+        return checkpoints.NO_POSITION
+    return round((horizontal_position - NumSteps.INK_WIDTH) / NumSteps.CHARACTER_WIDTH)
+
+
+def group_layouts(code: str) -> list[str]:
+    """
+    Lists ways to split positions of code into groups that are inked and
+    printed together, as layouts for the "groups" plan action. Groups are
+    printed in order of their first position. Codes longer than the maximum
+    exact grouping are only split into runs of neighbouring positions.
+    """
+    length = len(code)
+    # Group number of each position, numbering groups as they first appear
+    assignments: list[list[int]] = [[0]]
+    for position in range(1, length):
+        if length <= Chassis.MAX_EXACT_GROUPING:
+            assignments = [
+                groups + [group]
+                for groups in assignments
+                for group in range(max(groups) + 2)
+            ]
+        else:
+            assignments = [
+                groups + [group]
+                for groups in assignments
+                for group in (groups[-1], groups[-1] + 1)
+            ]
+    return [
+        Chassis.GROUP_SEPARATOR.join(
+            "".join(
+                character if group == number else Chassis.GAP
+                for character, group in zip(code, groups)
+            )
+            for number in range(max(groups) + 1)
+        )
+        for groups in assignments
+    ]
+
+
+@lru_cache(maxsize=Chassis.PLAN_CACHE_SIZE)
+def choose_strategy(
+    code: str, start: ChassisState, max_ink_age: float, max_ink_stamps: int
+) -> tuple[str, str]:
+    """
+    Compiles print_slow() and every grouping of code from start state, and
+    picks the quickest plan whose ink is never older than the maximum age
+    nor used for more than the maximum stamps. Picks plan with the freshest
+    ink if none is. Returns plan action and code or layout to run it with.
+    """
+    candidates = [("slow", code)] + [
+        ("groups", layout) for layout in group_layouts(code)
+    ]
+    scores = []
+    for action, layout in candidates:
+        plan = compile_plan(action, layout, start)
+        age, stamps = plan.ink_usage()
+        fresh = age <= max_ink_age and stamps <= max_ink_stamps
+        scores.append((not fresh, plan.seconds() if fresh else age, action, layout))
+    _, _, action, layout = min(scores)
+    return action, layout
+
+
+@lru_cache(maxsize=Chassis.PLAN_CACHE_SIZE)
+def choose_batch_strategy(
+    codes: tuple[str, ...], start: ChassisState, max_ink_age: float, max_ink_stamps: int
+) -> Optional[tuple[str, str]]:
+    """
+    Weighs inking for upcoming codes in one pass against printing the first
+    of them on its own with choose_strategy(). Inking is charged to the codes
+    ink_window() inks it for. Codes with gaps are always batched, as
+    print_slow() cannot skip them. Returns plan action and code or layout to
+    print first code on its own with, or None if inking for several codes is
+    quicker per code.
+    """
+    if Chassis.GAP in codes[0]:
+        return None
+    printed, seconds = ink_window(codes, start, max_ink_age, max_ink_stamps)
+    # Picks first code's own plan only if its ink stays fresh
+    action, layout = choose_strategy(codes[0], start, max_ink_age, max_ink_stamps)
+    plan = compile_plan(action, layout, start)
+    oldest, most = plan.ink_usage()
+    if (
+        oldest <= max_ink_age
+        and most <= max_ink_stamps
+        and plan.seconds() < seconds / printed
+    ):
+        return action, layout
+    return None
+
+
+@lru_cache(maxsize=Chassis.PLAN_CACHE_SIZE)
+def ink_window(
+    codes: tuple[str, ...], start: ChassisState, max_ink_age: float, max_ink_stamps: int
+) -> tuple[int, float]:
+    """
+    Finds how many upcoming codes to ink for in one pass: the most that can
+    be inked and printed before ink from start of pass gets older than the
+    maximum age, without any character making more than the maximum stamps.
+    Always includes first code. Returns number of codes, and seconds to ink
+    and print them.
+    """
+    window = (0, 0.0)
+    for size in range(1, len(codes) + 1):
+        characters = "".join(codes[:size]).replace(Chassis.GAP, "")
+        if size > 1 and any(
+            characters.count(character) > max_ink_stamps
+            for character in set(characters)
+        ):
+            break
+        ink = compile_plan("ink", characters, start)
+        seconds, state = ink.seconds(), ink.end_states[-1]
+        for code in codes[:size]:
+            plan = compile_plan("print", code, state)
+            seconds += plan.seconds()
+            state = plan.end_states[-1]
+        if size > 1 and seconds > max_ink_age:
+            break
+        window = (size, seconds)
+    return window
+
+
+def _check_interlock(plan: Plan) -> None:
+    """
+    Checks that wheel never turns while stamp is on a surface, or in a stage
+    where stamp is lowered onto one. Raises error otherwise.
+    """
+    state = plan.start
+    for stage, lanes in enumerate(plan.stages):
+        turns = touches = False
+        for start, end in lanes:
+            # Follows position along lane from start of stage
+            horizontal, vertical = state.horizontal, state.vertical
+            for index in range(start, end):
+                axis = plan.axes[index]
+                steps = plan.steps[index] * plan.directions[index]
+                if axis == Axes.WHEEL:
+                    turns = True
+                    if Chassis._touches(horizontal, vertical):
+                        raise ValueError(
+                            "Wheel cannot turn while stamp is on a surface!"
+                        )
+                elif axis == Axes.HORIZONTAL:
+                    horizontal += steps * Directions.RIGHT
+                elif axis == Axes.VERTICAL:
+                    vertical += steps * Directions.DOWN
+                touches = touches or Chassis._touches(horizontal, vertical)
+        # Lanes of a stage run together, so any contact blocks the wheel
+        if turns and touches and len(lanes) > 1:
+            raise ValueError("Stamp cannot be lowered while wheel is turning!")
+        state = plan.end_states[stage]
+
+
+class Stopped(RuntimeError):
+    """
+    Raised when moves are halted by a stop request.
+    """
+
+
+class HomingFault(RuntimeError):
+    """
+    Raised when an axis is not stopped by its limit switch while zeroing.
+    """
+
+
+class _EngineMove:
+    """
+    Move being streamed by stepping engine.
+    """
+
+    __slots__ = (
+        "coil_pins",
+        "direction",
+        "pieces",
+        "stop",
+        "halted",
+        "done",
+        "error",
+        "half_steps",
+        "piece",
+        "remaining",
+        "interval",
+        "deadline",
+    )
+
+    def __init__(
+        self,
+        coil_pins: tuple[int, ...],
+        pieces: list[tuple[int, float]],
+        direction: int,
+        stop: Optional[Event],
+    ) -> None:
+        self.coil_pins = coil_pins
+        self.direction = direction
+        # Half steps and seconds between them for each piece
+        self.pieces = pieces
+        self.stop = stop
+        self.halted = False
+        self.done = Event()
+        self.error: Optional[BaseException] = None
+        self.half_steps = 0
+        self.piece = 0
+        self.remaining, self.interval = pieces[0] if pieces else (0, 0.0)
+        self.deadline = 0.0
+
+
+class SteppingEngine:
+    """
+    Streams coil phases for every motor from one high priority thread. Moves
+    are queued from any thread and run interleaved by deadline, sleeping until
+    just before each half step and spinning the rest of the way. Keeps a
+    histogram of how late each half step was written. A stop request wakes
+    stepping thread and ends every move before its next half step, and moves
+    are refused until stop is cleared.
+    """
+
+    # Fraction of current half step interval before a half step to stop
+    # sleeping and start spinning, and limits on seconds spun
+    SPIN_FRACTION = 0.25
+    SPIN_MARGIN_MIN = 0.0002
+    SPIN_MARGIN_MAX = 0.0015
+    # Real time priority for stepping thread, if allowed
+    PRIORITY = 50
+    # Seconds other threads may hold interpreter before stepping thread
+    SWITCH_INTERVAL = 0.0005
+    # Upper edges of lateness histogram buckets, in microseconds
+    ERROR_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+    # Milliseconds stop button presses are ignored after one
+    STOP_BOUNCE_MS = 200
+
+    def __init__(self) -> None:
+        """
+        Creates engine. Thread starts on first move.
+        """
+        # Appends and pops of a deque are atomic, so queueing takes no lock
+        self._commands: deque[_EngineMove] = deque()
+        self._wake = Event()
+        self._start_lock = Lock()
+        self._thread: Optional[Thread] = None
+        # Half steps written to each motor, signed by direction, whose last
+        # three bits are its coil phase
+        self._positions: dict[tuple[int, ...], int] = {}
+        # Set while moves are stopped, and why
+        self.halted = Event()
+        self.stop_reason = ""
+        self._resumed = Event()
+        self._resumed.set()
+        # Half step lateness statistics
+        self._buckets = [edge / 1e6 for edge in self.ERROR_BUCKETS]
+        self.histogram = [0] * (len(self.ERROR_BUCKETS) + 1)
+        self.pulses = 0
+        self.worst_error = 0.0
+        self.total_error = 0.0
+
+    def run(
+        self,
+        coil_pins: tuple[int, ...],
+        pieces: list[tuple[float, float]],
+        direction: int,
+        stop: Optional[Event] = None,
+    ) -> float:
+        """
+        Steps motor through pieces of steps and RPM, and waits until finished.
+        Optional event parameter, checked before every half step, that ends
+        the move early. Returns number of steps taken.
+        """
+        # Rounds running total so fractional pieces never add up to drift
+        half_step_pieces = []
+        total, taken = 0.0, 0
+        for piece_steps, rpm in pieces:
+            total += piece_steps
+            half_steps = round(total * 2) - taken
+            taken += half_steps
+            if half_steps:
+                interval = 60 / (rpm * Chassis.STEPS_PER_REVOLUTION * 2)
+                half_step_pieces.append((half_steps, interval))
+        if not half_step_pieces:
+            return 0.0
+        if self.halted.is_set():
+            raise Stopped(self.stop_reason)
+        init_hardware()
+        move = _EngineMove(coil_pins, half_step_pieces, direction, stop)
+        start = clock.perf_counter()
+        # Steps in calling thread on simulated clock, jumping between steps
+        if SIMULATED:
+            move.deadline = start
+            while not self._pulse(move, move.deadline):
+                clock.sleep(move.deadline - clock.perf_counter())
+        else:
+            self._start()
+            self._commands.append(move)
+            self._wake.set()
+            move.done.wait()
+        if tracer is not None:
+            tracer.segment(
+                _AXIS_PINS.index(tuple(coil_pins)),
+                direction,
+                start,
+                clock.perf_counter(),
+                move.half_steps / 2,
+                max(rpm for _, rpm in pieces),
+            )
+        if move.error is not None:
+            raise move.error
+        if move.halted:
+            raise Stopped(self.stop_reason)
+        return move.half_steps / 2
+
+    def halt(self, reason: str) -> None:
+        """
+        Stops every move before its next half step, leaving coils holding
+        their last phase, and refuses new moves until resumed. Safe to call
+        from any thread. Takes reason as parameter.
+        """
+        self.stop_reason = reason
+        self._resumed.clear()
+        self.halted.set()
+        self._wake.set()
+
+    def resume(self) -> None:
+        """
+        Accepts moves again after a stop.
+        """
+        self.halted.clear()
+        self._resumed.set()
+
+    def wait_resumed(self) -> None:
+        """
+        Waits until moves are accepted again, if stopped.
+        """
+        self._resumed.wait()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Waits with no motor moving, ending early if stopped. Raises Stopped
+        if stopped before or during the wait.
+        """
+        if SIMULATED:
+            clock.sleep(seconds)
+            stopped = self.halted.is_set()
+        else:
+            stopped = self.halted.wait(seconds)
+        if stopped:
+            raise Stopped(self.stop_reason)
+
+    def position(self, coil_pins: tuple[int, ...]) -> int:
+        """
+        Returns half steps written to motor since engine was created, signed
+        by direction.
+        """
+        return self._positions.get(tuple(coil_pins), 0)
+
+    def jitter(self) -> dict[str, Any]:
+        """
+        Reports how late half steps were written. Returns counts by upper
+        bucket edge in microseconds, total half steps, and total and worst
+        lateness.
+        """
+        edges = [str(edge) for edge in self.ERROR_BUCKETS] + ["inf"]
+        return {
+            "buckets_us": dict(zip(edges, self.histogram)),
+            "pulses": self.pulses,
+            "total_us": round(self.total_error * 1e6, 1),
+            "worst_us": round(self.worst_error * 1e6, 1),
+        }
+
+    def _start(self) -> None:
+        """
+        Starts stepping thread if it is not already running.
+        """
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                # Hands interpreter back to stepping thread sooner
+                sys.setswitchinterval(self.SWITCH_INTERVAL)
+                self._thread = Thread(
+                    target=self._loop, name="stepping-engine", daemon=True
+                )
+                self._thread.start()
+
+    def _loop(self) -> None:
+        """
+        Writes next due half step of any active move, forever.
+        """
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.PRIORITY))
+        except (AttributeError, OSError):
+            print("Stepping engine running without real time priority.")
+        now_of = clock.perf_counter
+        active: list[_EngineMove] = []
+        while True:
+            # Takes queued moves, starting them now
+            while self._commands:
+                move = self._commands.popleft()
+                move.deadline = now_of()
+                active.append(move)
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            # Waits for move due soonest, waking early if stopped, and spins
+            # for a share of its interval so fast moves are not spun through
+            move = min(active, key=lambda move: move.deadline)
+            margin = min(
+                max(move.interval * self.SPIN_FRACTION, self.SPIN_MARGIN_MIN),
+                self.SPIN_MARGIN_MAX,
+            )
+            remaining = move.deadline - now_of()
+            if remaining > margin:
+                self.halted.wait(remaining - margin)
+            # Ends every move at once when stopped
+            if self.halted.is_set():
+                for move in list(active):
+                    move.halted = True
+                    self._finish(move, active)
+                continue
+            while now_of() < move.deadline:
+                pass
+            if self._pulse(move, now_of()):
+                self._finish(move, active)
+
+    def _pulse(self, move: _EngineMove, now: float) -> bool:
+        """
+        Writes next half step of move unless it was stopped, and schedules the
+        one after. Takes time half step was written as parameter. Returns
+        whether move is finished.
+        """
+        # Ends move early if stopped or asked to
+        if self.halted.is_set():
+            move.halted = True
+            return True
+        if move.stop is not None and move.stop.is_set():
+            return True
+        # Writes next coil phase in direction
+        position = self._positions.get(move.coil_pins, 0) + move.direction
+        try:
+            GPIO.output(  # type: ignore
+                move.coil_pins, Homing.HALFSTEP_PHASES[position % 8]
+            )
+        except Exception as error:
+            move.error = error
+            return True
+        self._positions[move.coil_pins] = position
+        move.half_steps += 1
+        # Records lateness
+        error = now - move.deadline
+        self.histogram[bisect_left(self._buckets, error)] += 1
+        self.pulses += 1
+        self.total_error += error
+        if error > self.worst_error:
+            self.worst_error = error
+        # Moves on to next half step, or next piece
+        move.remaining -= 1
+        if not move.remaining:
+            move.piece += 1
+            if move.piece == len(move.pieces):
+                return True
+            move.remaining, move.interval = move.pieces[move.piece]
+        move.deadline += move.interval
+        # Restarts timing instead of rushing to catch up after a stall
+        if move.deadline < now:
+            move.deadline = now + move.interval
+        return False
+
+    @staticmethod
+    def _finish(move: _EngineMove, active: list[_EngineMove]) -> None:
+        active.remove(move)
+        move.done.set()
+
+
+# Steps every motor
+engine = SteppingEngine()
+
+
+@lru_cache(maxsize=None)
+def _speed_curve(
+    profile: Profile, steps_per_revolution: int
+) -> tuple[list[float], list[float]]:
+    """
+    Simulates axis speeding up from rest under profile. Returns distances in
+    steps and RPM reached at each, up to maximum RPM.
+    """
+    TIME_STEP = 0.001
+    distances, speeds = [0.0], [profile.start_rpm]
+    rpm, acceleration, distance = profile.start_rpm, 0.0, 0.0
+    while rpm < profile.max_rpm:
+        # Raises acceleration by jerk, easing off so speed levels out at max
+        if profile.jerk:
+            acceleration = min(
+                acceleration + profile.jerk * TIME_STEP,
+                profile.acceleration,
+                sqrt(2 * profile.jerk * (profile.max_rpm - rpm)),
+            )
+        else:
+            acceleration = profile.acceleration
+        rpm = min(rpm + acceleration * TIME_STEP, profile.max_rpm)
+        distance += rpm / 60 * steps_per_revolution * TIME_STEP
+        distances.append(distance)
+        speeds.append(rpm)
+    return distances, speeds
 
 
 def main() -> None:
     """
-    Runs main stamper actions.
+    Runs motion controller. Prints queued jobs and answers the web process,
+    which runs separately, over a local socket.
     """
-    # Creates and starts flask thread
-    flask_thread = Thread(target=webapp.run_flask)
-    flask_thread.start()
-    # Helper function for accessing code fom sheet.
-    get_code = lambda: str(get_cell(Cells.CODE))
+    global journal
     # Sets running state to false
     set_cell(Cells.RUNNING, False)
-    # Creates chassis object
-    chassis = Chassis(STARTING_CHARACTER)
+    # Queues again jobs left running when controller last stopped
+    jobs.recover()
+    # Opens checkpoints, forgetting jobs that finished before being
+    # checkpointed as finished
+    journal = checkpoints.Journal()
+    atexit.register(journal.close)
+    for job_id in journal.unfinished():
+        job = jobs.get(job_id)
+        if job is None or job.state != JobStates.QUEUED:
+            journal.finish(job_id)
+    # Wheel is where last checkpoint left it if a job was interrupted
+    interrupted = journal.last if journal.unfinished() else None
+    # Job being printed, reported to web process
+    current: dict[str, Optional[int]] = {"job": None}
+    chassis: Optional[Chassis] = None
+    # Plan-timed ETAs of queued jobs, published to web process as a whole
+    refined: dict[str, dict] = {"etas": {"ids": [], "seconds": []}}
+    queue_changed = Event()
+    # Stays stopped across restarts until stop is cleared
+    if get_cell(Cells.STOP):
+        request_stop("stopped before controller restarted")
 
-    # Initializes previous code
-    previous_code = get_code()
+    def stop(message: dict) -> dict:
+        cancel = bool(message.get("cancel"))
+        # Cancelling with no job running would cancel the next one instead
+        if cancel and current["job"] is None:
+            return {"stopped": False}
+        request_stop(message.get("reason") or "requested from web app", cancel)
+        return {"stopped": True}
+
+    def wake(_: dict) -> None:
+        # Web process queued jobs straight into the database
+        jobs.wake()
+        queue_changed.set()
+
+    def refine_etas() -> None:
+        # Times queue from compiled plans in another process whenever it
+        # changes
+        refiner = estimator.Refiner()
+        atexit.register(refiner.close)
+        while True:
+            queue_changed.wait()
+            queue_changed.clear()
+            active = jobs.active()[: estimator.REFINE_LIMIT]
+            start = chassis.current_character if chassis else STARTING_CHARACTER
+            try:
+                seconds = refiner.queue_eta([job.code for job in active], start)
+            except (OSError, ValueError) as error:
+                print(f"Could not refine ETAs: {error!r}")
+                continue
+            refined["etas"] = {"ids": [job.id for job in active], "seconds": seconds}
+
+    server = ControllerServer(
+        {
+            "status": lambda _: {
+                "running": bool(get_cell(Cells.RUNNING)),
+                "job": current["job"],
+                "character": chassis.current_character if chassis else None,
+                "stopped": bool(get_cell(Cells.STOP)),
+            },
+            "wake": wake,
+            "eta": lambda _: {
+                "character": chassis.current_character if chassis else None,
+                **refined["etas"],
+            },
+            "events": _event_stream,
+            "stop": stop,
+            "resume": lambda _: clear_stop(),
+            "metrics": lambda _: {
+                "phases": recorder.snapshot(),
+                "jitter": engine.jitter(),
+                "running": bool(get_cell(Cells.RUNNING)),
+            },
+        }
+    )
+    server.start()
+    atexit.register(server.stop)
+    # Creates chassis object, zeroing unless stopped
+    try:
+        chassis = Chassis(STARTING_CHARACTER, zero=not engine.halted.is_set())
+    except Stopped:
+        # Zeros before first job instead
+        chassis = Chassis(STARTING_CHARACTER, zero=False)
+    except HomingFault as fault:
+        # Tries again before first job, which fails if switch is still missed
+        print(f"Zeroing failed: {fault}")
+        chassis = Chassis(STARTING_CHARACTER, zero=False)
+    if interrupted is not None:
+        chassis.assume_wheel_position(interrupted.wheel_position)
+    # Builds cycle time estimates in another process if they are out of date,
+    # importing estimator only now as numpy is slow to import
+    import estimator
+
+    estimator.build_in_background()
+    Thread(target=refine_etas, daemon=True).start()
+    queue_changed.set()
     # Loops stamping actions
     while True:
-        time.sleep(1)
-        print("Scanning for new code...")
-        # Gets code
-        current_code = get_code()
-        # If code is different:
-        if current_code != previous_code:
-            print("NEW CODE, SETTING SHEET")
-            # Sets sheet running boolean TRUE
-            set_cell(Cells.RUNNING, True)
+        # Holds queued jobs while stopped
+        if get_cell(Cells.STOP):
+            print("Stopped, waiting to be cleared...")
+            engine.wait_resumed()
+        print("Waiting for new jobs...")
+        # Blocks until jobs are queued, then takes a batch of them
+        batch = next_jobs(Chassis.BATCH_SIZE)
+        # Returns batch if stopped while waiting for it
+        if get_cell(Cells.STOP):
+            jobs.release(job.id for job in batch)
+            continue
+        # Skips positions already printed by interrupted jobs, finishing any
+        # that printed every character
+        layouts: dict[int, str] = {}
+        for job in list(batch):
+            printed_positions = journal.printed(job.id)
+            if not printed_positions:
+                continue
+            layout = "".join(
+                Chassis.GAP if position in printed_positions else character
+                for position, character in enumerate(job.code)
+            )
+            if not layout.strip(Chassis.GAP):
+                jobs.finish(job.id)
+                journal.finish(job.id)
+                batch.remove(job)
+                continue
+            print(f"Resuming job #{job.id} as {layout}")
+            layouts[job.id] = layout
+        if not batch:
+            continue
+        print(f"NEW JOBS #{batch[0].id}-#{batch[-1].id}, SETTING SHEET")
+        # Sets sheet running boolean TRUE
+        set_cell(Cells.RUNNING, True)
+        # Counts jobs finished so far
+        printed = 0
+
+        def start_job() -> None:
+            job = batch[printed]
+            current["job"] = job.id
+            journal.begin(job.id)
+            _report("started", job=job.id, code=job.code, pending=jobs.pending())
+
+        def resume_if_cancelled() -> None:
+            # Cancel that arrives as job finishes is too late to stop it
+            if engine.halted.is_set() and not get_cell(Cells.STOP):
+                engine.resume()
+
+        def finish_job(_: str) -> None:
+            nonlocal printed
+            job = batch[printed]
+            # Journal is finished last, so a crash between never loses a job
+            jobs.finish(job.id)
+            journal.finish(job.id)
+            resume_if_cancelled()
+            _report("done", job=job.id, code=job.code, pending=jobs.pending())
+            printed += 1
+            if printed < len(batch):
+                start_job()
+
+        start_job()
+
+        try:
             # Prints
-            time.sleep(1)
-            print(f"Printing code: {current_code}")
-            chassis.print_fast(current_code)
-            time.sleep(1)
-            # Sets sheet running boolean FALSE
-            set_cell(Cells.RUNNING, False)
-        # Sets previous code for next loop
-        previous_code = current_code
+            chassis.print_batch(
+                [layouts.get(job.id, job.code) for job in batch],
+                on_printed=finish_job,
+            )
+        except Stopped as stopped:
+            # Position is unknown once moves end partway
+            chassis.stopped(f"stopped during job #{batch[printed].id}")
+            if get_cell(Cells.STOP):
+                # Returns current and unprinted jobs to queue to print later
+                print(f"Job #{batch[printed].id} stopped, returned to queue")
+                jobs.release(job.id for job in batch[printed:])
+            else:
+                # Cancels only current job and returns the rest to queue
+                error = f"Cancelled: {stopped}"
+                print(f"Job #{batch[printed].id} {error}")
+                jobs.finish(batch[printed].id, error)
+                journal.finish(batch[printed].id)
+                jobs.release(job.id for job in batch[printed + 1 :])
+                _report("cancelled", job=batch[printed].id, error=error)
+        except Exception as exception:
+            # Records failure and returns unprinted jobs to queue
+            error = repr(exception)
+            print(f"Job #{batch[printed].id} failed: {error}")
+            chassis.distrust_position(f"job #{batch[printed].id} failed")
+            jobs.finish(batch[printed].id, error)
+            journal.finish(batch[printed].id)
+            jobs.release(job.id for job in batch[printed + 1 :])
+            _report("failed", job=batch[printed].id, error=error)
+        finally:
+            current["job"] = None
+            journal.begin(None)
+            resume_if_cancelled()
+            queue_changed.set()
+            # Sets sheet running boolean FALSE once queue is drained
+            if not jobs.pending():
+                set_cell(Cells.RUNNING, False)
+                _report("idle", job=None, code=None, character=None, pending=0)
 
 
 if __name__ == "__main__":
+    # Stops cleanly when terminated as well as interrupted
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
         main()
     # Catches keyboard interrupt
     except KeyboardInterrupt:
-        # Stops flask
-        webapp.stop_flask()
         # Cleans up board
-        stepper.board_cleanup()
+        cleanup_hardware()
@@ -0,0 +1,116 @@
+// Shows live job progress from the stamper's event stream, polling status
+// instead where event streams are unavailable.
+(function () {
+    "use strict";
+
+    var EVENTS = [
+        "status", "queued", "started", "zeroing", "inking", "printing",
+        "done", "failed", "idle", "disconnected", "stopped", "cancelling",
+        "cancelled", "resumed"
+    ];
+    var POLL_MS = 5000;
+    var element = document.getElementById("live-status");
+    if (!element) {
+        return;
+    }
+    // Job submitted from this page, if any
+    var mine = parseInt(element.dataset.job, 10);
+    var state = {};
+
+    function describe() {
+        var parts = [];
+        if (state.connected === false) {
+            return "Stamper is offline.";
+        }
+        if (state.stopped) {
+            return "Stopped (" + (state.reason || "stop requested") +
+                "). Queued codes wait until resumed.";
+        }
+        if (state.activity === "cancelled") {
+            parts.push("Job #" + state.job + " was cancelled.");
+        } else if (state.activity === "inking" || state.activity === "printing") {
+            parts.push(
+                state.activity.charAt(0).toUpperCase() + state.activity.slice(1) +
+                " " + state.character + " of job #" + state.job + "."
+            );
+        } else if (state.activity === "zeroing") {
+            parts.push("Zeroing before job #" + state.job + ".");
+        } else if (state.job) {
+            parts.push("Printing job #" + state.job + ".");
+        } else {
+            parts.push("Stamper is idle.");
+        }
+        if (state.pending) {
+            parts.push(state.pending + " waiting.");
+        }
+        if (!isNaN(mine)) {
+            if (state.job === mine) {
+                parts.push("Your code is being printed.");
+            } else if (state.job && state.job > mine) {
+                parts.push("Your code has been printed.");
+            } else if (state.job || state.pending) {
+                // Jobs run in order of ID, so this is close but not exact
+                var ahead = Math.max(
+                    Math.min(mine - (state.job || mine) - 1, state.pending || 0), 0
+                );
+                parts.push(ahead + " ahead of your code.");
+            }
+        }
+        return parts.join(" ");
+    }
+
+    function render(update) {
+        for (var key in update) {
+            if (key !== "type") {
+                state[key] = update[key];
+            }
+        }
+        element.textContent = describe();
+    }
+
+    function poll() {
+        fetch("/api/status", {cache: "no-cache"})
+            .then(function (response) { return response.json(); })
+            .then(function (status) {
+                // Status only names activity while a job runs
+                render({activity: status.job ? null : "idle", character: null});
+                render(status);
+            })
+            .catch(function () { render({connected: false}); });
+    }
+
+    function startPolling() {
+        poll();
+        window.setInterval(poll, POLL_MS);
+    }
+
+    // Sends stop, cancel and resume to the stamper
+    document.querySelectorAll("[data-control]").forEach(function (button) {
+        button.addEventListener("click", function () {
+            fetch("/api/" + button.dataset.control, {method: "POST"})
+                .then(function (response) { return response.json(); })
+                .then(function (result) {
+                    if (result.error) {
+                        element.textContent = result.error;
+                    }
+                });
+        });
+    });
+
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    var source = new EventSource("/events");
+    EVENTS.forEach(function (kind) {
+        source.addEventListener(kind, function (event) {
+            render(JSON.parse(event.data));
+        });
+    });
+    source.onerror = function () {
+        // Browser retries dropped streams itself, but not refused ones
+        if (source.readyState === EventSource.CLOSED) {
+            startPolling();
+        }
+    };
+})();
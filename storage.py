@@ -1,23 +1,36 @@
 """
 ## Storage
-Allows for storage of stamper data, such as code and running status.
+Allows for storage of stamper data, such as code and running status. Cell
+values are held in memory and written to a database in batches. The Excel
+sheet is kept as an export for viewing externally.
 """
 
-from typing import Any
+import atexit
+import json
+import os
+import sqlite3
+import time
+from threading import Condition, Event, Lock, Thread
+from typing import TYPE_CHECKING, Any, Iterable, NamedTuple, Optional
 
-from openpyxl import Workbook, load_workbook
+# Excel library is slow to import, so is only imported when a sheet is used
+if TYPE_CHECKING:
+    from openpyxl import Workbook
 
 __author__ = "Ben Kraft"
 __copyright__ = "None"
 __credits__ = "Ben Kraft"
 __license__ = "Apache"
-__version__ = "0.0.1"
+__version__ = "0.1.0"
 __maintainer__ = "Ben Kraft"
 __email__ = "ben.kraft@rcn.com"
 __status__ = "Prototype"
 
 FILENAME = "stamper_data.xlsx"
 SHEETNAME = "stamper_data"
+DATABASE = "stamper_data.db"
+# Seconds to collect changes for before writing them to disk
+FLUSH_INTERVAL = 2.0
 
 
 class Cells:
@@ -30,6 +43,364 @@ class Cells:
     STOP = "A3"
 
 
+class JobStates:
+    """
+    Establishes states a print job moves through.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(NamedTuple):
+    """
+    A single code print job.
+    """
+
+    id: int
+    code: str
+    state: str
+    created: float
+    started: Optional[float]
+    finished: Optional[float]
+    error: Optional[str]
+
+
+class StateStore:
+    """
+    A process-wide store for cell values. Reads are answered from memory and
+    changed cells are flushed to the database in batches.
+    """
+
+    def __init__(
+        self, database: str = DATABASE, flush_interval: float = FLUSH_INTERVAL
+    ) -> None:
+        """
+        A process-wide store for cell values. Takes database filename as
+        parameter. Optional flush interval parameter.
+        """
+        self.database = database
+        self.flush_interval = flush_interval
+        # Cached values and cells changed since last flush
+        self._values: dict[str, Any] = {}
+        self._dirty: set[str] = set()
+        self._lock = Lock()
+        self._changed = Event()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._flusher: Optional[Thread] = None
+
+    def _load(self) -> None:
+        """
+        Opens database and reads all cells into memory. Imports values from
+        the Excel sheet if the database is new. Must be called with lock held.
+        """
+        # Opens database with write-ahead log for cheap appends
+        self._connection = sqlite3.connect(self.database, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cells (cell TEXT PRIMARY KEY, value TEXT)"
+        )
+        rows = self._connection.execute("SELECT cell, value FROM cells").fetchall()
+        # Decodes stored values
+        self._values = {cell: json.loads(value) for cell, value in rows}
+        # If database is new, carries over values from sheet
+        if not rows:
+            self._values = _read_workbook()
+            self._dirty.update(self._values)
+            # Wakes background writer to store them
+            self._changed.set()
+        # Starts background writer
+        self._flusher = Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def get(self, cell: str) -> Any:
+        """
+        Gets value of specified cell from memory.
+        """
+        with self._lock:
+            if self._connection is None:
+                self._load()
+            return self._values.get(cell)
+
+    def set(self, cell: str, value: Any) -> None:
+        """
+        Sets specified cell to value in memory and schedules it for writing.
+        """
+        with self._lock:
+            if self._connection is None:
+                self._load()
+            # Skips writes that change nothing
+            if cell in self._values and self._values[cell] == value:
+                return
+            self._values[cell] = value
+            self._dirty.add(cell)
+        # Wakes background writer
+        self._changed.set()
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Returns copy of all cell values.
+        """
+        with self._lock:
+            if self._connection is None:
+                self._load()
+            return dict(self._values)
+
+    def flush(self) -> None:
+        """
+        Writes all changed cells to database in a single transaction.
+        """
+        with self._lock:
+            if self._connection is None or not self._dirty:
+                return
+            rows = [(cell, json.dumps(self._values[cell])) for cell in self._dirty]
+            self._dirty.clear()
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO cells (cell, value) VALUES (?, ?)", rows
+                )
+
+    def _flush_loop(self) -> None:
+        """
+        Waits for changes and flushes them once per flush interval.
+        """
+        while True:
+            self._changed.wait()
+            # Gathers further changes before writing
+            time.sleep(self.flush_interval)
+            self._changed.clear()
+            self.flush()
+
+
+class JobQueue:
+    """
+    A durable first-in first-out queue of print jobs. Jobs are kept in the
+    database so they survive restarts.
+    """
+
+    _COLUMNS = "id, code, state, created, started, finished, error"
+
+    def __init__(self, database: str = DATABASE) -> None:
+        """
+        A durable first-in first-out queue of print jobs. Takes database
+        filename as parameter.
+        """
+        self.database = database
+        self._connection: Optional[sqlite3.Connection] = None
+        # Guards connection and wakes waiting consumers
+        self._available = Condition()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns database connection, creating jobs table on first use. Must
+        be called with lock held.
+        """
+        if self._connection is None:
+            connection = sqlite3.connect(self.database, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Commits survive crashes without syncing on every append
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT NOT NULL, "
+                    "state TEXT NOT NULL, created REAL NOT NULL, started REAL, "
+                    "finished REAL, error TEXT)"
+                )
+                # Keeps finding next queued job cheap for long queues
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)"
+                )
+            self._connection = connection
+        return self._connection
+
+    def recover(self) -> None:
+        """
+        Queues again jobs left running by a stamper that stopped. Only the
+        process that prints jobs should call this.
+        """
+        with self._available:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, started = NULL WHERE state = ?",
+                    (JobStates.QUEUED, JobStates.RUNNING),
+                )
+            self._available.notify_all()
+
+    def wake(self) -> None:
+        """
+        Wakes consumers waiting for jobs, such as after another process
+        queued some.
+        """
+        with self._available:
+            self._available.notify_all()
+
+    def push(self, code: str) -> int:
+        """
+        Adds code to end of queue. Returns job ID.
+        """
+        return self.push_many([code])[0]
+
+    def push_many(self, codes: Iterable[str]) -> list[int]:
+        """
+        Adds codes to end of queue in a single transaction. Returns job IDs in
+        order.
+        """
+        now = time.time()
+        rows = [(code, JobStates.QUEUED, now) for code in codes]
+        with self._available:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO jobs (code, state, created) VALUES (?, ?, ?)", rows
+                )
+                # IDs within one transaction are consecutive
+                (last_id,) = connection.execute("SELECT last_insert_rowid()").fetchone()
+            # Wakes consumers
+            self._available.notify_all()
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def pop(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """
+        Waits for oldest queued job and marks it running. Optional timeout
+        parameter, after which None is returned.
+        """
+        popped = self.pop_many(1, timeout)
+        return popped[0] if popped else None
+
+    def pop_many(self, limit: int, timeout: Optional[float] = None) -> list[Job]:
+        """
+        Waits for queued jobs and marks up to limit of the oldest running.
+        Optional timeout parameter, after which an empty list is returned.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._available:
+            connection = self._connect()
+            while True:
+                rows = connection.execute(
+                    f"SELECT {self._COLUMNS} FROM jobs WHERE state = ? "
+                    "ORDER BY id LIMIT ?",
+                    (JobStates.QUEUED, limit),
+                ).fetchall()
+                if rows:
+                    break
+                # Waits for new jobs until deadline
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._available.wait(remaining)
+            started = time.time()
+            popped = [
+                Job(*row)._replace(state=JobStates.RUNNING, started=started)
+                for row in rows
+            ]
+            with connection:
+                connection.executemany(
+                    "UPDATE jobs SET state = ?, started = ? WHERE id = ?",
+                    [(job.state, job.started, job.id) for job in popped],
+                )
+        return popped
+
+    def release(self, job_ids: Iterable[int]) -> None:
+        """
+        Returns running jobs to queue without changing their order.
+        """
+        with self._available:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "UPDATE jobs SET state = ?, started = NULL WHERE id = ?",
+                    [(JobStates.QUEUED, job_id) for job_id in job_ids],
+                )
+            self._available.notify_all()
+
+    def finish(self, job_id: int, error: Optional[str] = None) -> None:
+        """
+        Marks job as done, or failed if an error is given.
+        """
+        state = JobStates.FAILED if error else JobStates.DONE
+        with self._available:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, finished = ?, error = ? WHERE id = ?",
+                    (state, time.time(), error, job_id),
+                )
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """
+        Returns job with specified ID, if it exists.
+        """
+        with self._available:
+            row = (
+                self._connect()
+                .execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+                .fetchone()
+            )
+        return None if row is None else Job(*row)
+
+    def active(self, until_id: Optional[int] = None) -> list[Job]:
+        """
+        Returns running and queued jobs in print order. Optional job ID
+        parameter, after which jobs are left out.
+        """
+        with self._available:
+            rows = (
+                self._connect()
+                .execute(
+                    f"SELECT {self._COLUMNS} FROM jobs WHERE state IN (?, ?) "
+                    "AND id <= ? ORDER BY id",
+                    (
+                        JobStates.RUNNING,
+                        JobStates.QUEUED,
+                        # Largest ID SQLite can store when no limit is given
+                        until_id if until_id is not None else 2**63 - 1,
+                    ),
+                )
+                .fetchall()
+            )
+        return [Job(*row) for row in rows]
+
+    def pending(self) -> int:
+        """
+        Returns number of queued jobs.
+        """
+        with self._available:
+            (count,) = (
+                self._connect()
+                .execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = ?", (JobStates.QUEUED,)
+                )
+                .fetchone()
+            )
+        return count
+
+    def position(self, job_id: int) -> int:
+        """
+        Returns number of queued jobs ahead of specified job.
+        """
+        with self._available:
+            (count,) = (
+                self._connect()
+                .execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = ? AND id < ?",
+                    (JobStates.QUEUED, job_id),
+                )
+                .fetchone()
+            )
+        return count
+
+
+# Shared store and job queue for this process
+store = StateStore()
+jobs = JobQueue()
+# Writes out pending changes on exit
+atexit.register(store.flush)
+
+
 def print_sheet(sheet: Any) -> None:
     """
     Prints values in specified sheet.
@@ -39,39 +410,82 @@ def print_sheet(sheet: Any) -> None:
 
 def set_cell(cell: str, value) -> None:
     """
-    Sets specified cell in worksheet to value.
+    Sets specified cell to value.
+    """
+    store.set(cell, value)
+
+
+def get_cell(cell: str) -> Any:
+    """
+    Gets value from specified cell.
+    """
+    return store.get(cell)
+
+
+def submit_codes(codes: Iterable[str]) -> list[int]:
+    """
+    Queues codes as print jobs and notifies stamper. Returns job IDs.
+    """
+    codes = list(codes)
+    # Records latest code for sheet viewers
+    if codes:
+        set_cell(Cells.CODE, codes[-1])
+    return jobs.push_many(codes)
+
+
+def next_jobs(limit: int = 1, timeout: Optional[float] = None) -> list[Job]:
+    """
+    Waits for queued jobs and marks up to limit of them running. Optional
+    timeout parameter, after which an empty list is returned.
+    """
+    return jobs.pop_many(limit, timeout)
+
+
+def export_workbook(filename: str = FILENAME) -> None:
+    """
+    Writes all current cell values to Excel sheet.
     """
     # Gets workbook and sheet from file
-    workbook, sheet = _get_workbook()
-    # Sets cell to value
-    sheet[cell] = value
+    workbook, sheet = _get_workbook(filename)
+    # Sets each cell to value
+    for cell, value in store.snapshot().items():
+        sheet[cell] = value
     # Saves workbook to file
-    workbook.save(FILENAME)
+    workbook.save(filename)
 
 
-def get_cell(cell: str) -> Any:
+def _read_workbook(filename: str = FILENAME) -> dict[str, Any]:
     """
-    Gets value from specified cell in worksheet.
+    Reads known cell values from Excel sheet, if it exists.
     """
-    # Gets sheet from file
-    _, sheet = _get_workbook()
-    # Returns cell value
-    return sheet[cell].value
+    if not os.path.exists(filename):
+        return {}
+    from openpyxl import load_workbook
+
+    try:
+        sheet = load_workbook(filename)[SHEETNAME]
+    except (FileNotFoundError, KeyError):
+        return {}
+    # Collects values of all defined cells
+    cells = [value for name, value in vars(Cells).items() if name.isupper()]
+    return {cell: sheet[cell].value for cell in cells}
 
 
-def _get_workbook() -> tuple[Workbook, Any]:  # type: ignore
+def _get_workbook(filename: str = FILENAME) -> tuple["Workbook", Any]:
     """
     Returns workbook and worksheet, creates new if they do not exist.
     """
+    from openpyxl import Workbook, load_workbook
+
     try:
         # Loads workbook from file
-        workbook = load_workbook(FILENAME)
+        workbook = load_workbook(filename)
     except FileNotFoundError:
         # Creates workbook and worksheet
         workbook = Workbook()
         workbook.create_sheet(SHEETNAME)
         # Saves new workbook
-        workbook.save(FILENAME)
+        workbook.save(filename)
     # Returns workbook and worksheet objects
     return workbook, workbook[SHEETNAME]
 
@@ -80,3 +494,6 @@ if __name__ == "__main__":
     # Prints out running status and code
     print(f"Running: {get_cell(Cells.RUNNING)}")
     print(f"Code: {get_cell(Cells.CODE)}")
+    print(f"Queued jobs: {jobs.pending()}")
+    # Updates sheet for external viewing
+    export_workbook()
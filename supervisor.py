@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+## Supervisor
+Starts the motion controller and web server as separate processes, so web
+traffic never competes with step timing, and restarts either if it exits.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+__author__ = "Ben Kraft"
+__copyright__ = "None"
+__credits__ = "Ben Kraft"
+__license__ = "Apache"
+__version__ = "0.0.1"
+__maintainer__ = "Ben Kraft"
+__email__ = "ben.kraft@rcn.com"
+__status__ = "Prototype"
+
+# Script run by each process
+PROCESSES = {"controller": "stamper.py", "web": "webapp.py"}
+# Seconds to wait before restarting a process that exited
+RESTART_DELAY = 2.0
+# Seconds to wait for processes to stop before killing them
+STOP_TIMEOUT = 5.0
+# Lets web process ask supervisor to shut everything down
+SUPERVISOR_PID = "STAMPER_SUPERVISOR_PID"
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def start(name: str) -> subprocess.Popen:
+    """
+    Starts process of specified name.
+    """
+    print(f"Starting {name}. . .")
+    environment = dict(os.environ, **{SUPERVISOR_PID: str(os.getpid())})
+    return subprocess.Popen(
+        [sys.executable, PROCESSES[name]], cwd=DIRECTORY, env=environment
+    )
+
+
+def stop(children: dict[str, subprocess.Popen]) -> None:
+    """
+    Interrupts processes so they clean up, killing any that do not stop.
+    """
+    for child in children.values():
+        if child.poll() is None:
+            child.send_signal(signal.SIGINT)
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for name, child in children.items():
+        try:
+            child.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            print(f"Killing {name}. . .")
+            child.kill()
+
+
+def main() -> None:
+    """
+    Runs both processes until interrupted, restarting any that exit.
+    """
+    # Stops cleanly when terminated as well as interrupted
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    children = {name: start(name) for name in PROCESSES}
+    try:
+        while True:
+            time.sleep(0.5)
+            for name, child in children.items():
+                if child.poll() is not None:
+                    print(f"{name.capitalize()} exited with code {child.returncode}")
+                    time.sleep(RESTART_DELAY)
+                    children[name] = start(name)
+    except KeyboardInterrupt:
+        print("Shutting down. . .")
+    finally:
+        stop(children)
+
+
+if __name__ == "__main__":
+    main()
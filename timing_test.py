@@ -1,41 +1,35 @@
 #!/usr/bin/env python
 """
 ## Timing Tests
-Exists to approximate the runtime of `Chassis.print_fast()`.
+Exists to approximate the runtime of `Chassis.print_fast()` and
+`Chassis.print_slow()` for every code, from cycle time estimates.
 """
 
-from stamper import NumSteps
+import os
+
+import estimator
 
 __author__ = "Ben Kraft"
 __copyright__ = "None"
 __credits__ = "Ben Kraft"
 __license__ = "Apache"
-__version__ = "0.0.1"
+__version__ = "0.1.0"
 __maintainer__ = "Ben Kraft"
 __email__ = "ben.kraft@rcn.com"
 __status__ = "Prototype"
 
-total_steps = (
-    NumSteps.INK_POSITION
-    - NumSteps.SURFACE_MARGIN
-    + (NumSteps.SURFACE_MARGIN * 2 + NumSteps.ADVANCE_CHARACTER * 8) * 4
-    + NumSteps.INK_WIDTH
-    + NumSteps.FLOOR_POSITION
-    - NumSteps.SURFACE_MARGIN
-    - NumSteps.INK_POSITION
-    + NumSteps.CHARACTER_WIDTH * 3
-    + (NumSteps.SURFACE_MARGIN * 2 + NumSteps.ADVANCE_CHARACTER * 8) * 4
-)
-
-print(f"Steps: {total_steps}")
-
-MOVE_RPM = 80.0
-STEPS_PER_REVOLUTION = 200
-
-REVOLUTIONS_PER_SECOND = MOVE_RPM / 60
-STEPS_PER_SECOND = REVOLUTIONS_PER_SECOND * STEPS_PER_REVOLUTION
-SECONDS_PER_STEP = 1 / STEPS_PER_SECOND
-
-seconds = total_steps * SECONDS_PER_STEP
-
-print(f"Seconds: {seconds}")
+# Plans are only compiled, so simulated hardware is enough
+os.environ.setdefault("STAMPER_BACKEND", "sim")
+
+# Builds estimates if they are missing or out of date
+if not estimator.is_current():
+    print("Building estimates. . .")
+    estimator.build()
+table = estimator.load()
+
+for mode in estimator.MODES:
+    seconds = table[mode]  # type: ignore
+    print(f"{mode.capitalize()}:")
+    print(f"  Mean seconds: {seconds.mean():.1f}")
+    print(f"  Best seconds: {seconds.min():.1f} ({seconds.argmin():04X})")
+    print(f"  Worst seconds: {seconds.max():.1f} ({seconds.argmax():04X})")
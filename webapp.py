@@ -2,9 +2,10 @@
 """
 ## Host
 Allows for the hosting of stamper site on local device. Code entry is stored in
-spreadsheet to be accessed externally.
+spreadsheet to be accessed externally. Runs in its own process and reaches the
+motion controller over a local socket.
 
-Dependencies: flask, flask-wtf, wtforms
+Dependencies: flask, flask-wtf, wtforms, waitress
 
 To check PID processes on port, run:
 $ lsof -wni tcp:<PORT>
@@ -13,17 +14,29 @@ To kill PID process:
 $ kill -9 <PID>
 """
 
+import csv
+import hashlib
+import io
+import json
 import os
 import signal
+import sys
+import time
+from functools import lru_cache
+from threading import BoundedSemaphore, Lock, Thread
+from typing import Any, Iterator, Optional
 
-import requests
-from flask import Flask, flash, render_template
+from flask import Flask, Response, flash, jsonify, render_template, request
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, ValidationError
 from wtforms.validators import DataRequired, Length
 
-from stamper import Chassis
-from storage import Cells, get_cell, set_cell
+import events
+import ipc
+import metrics
+from geometry import CHARACTERS, CODE_LENGTH, STARTING_CHARACTER
+from storage import JobStates, jobs, submit_codes
+from supervisor import SUPERVISOR_PID
 
 __author__ = "Ben Kraft"
 __copyright__ = "None"
@@ -39,22 +52,234 @@ DEFAULT_PORT = 5000
 
 INVALID_BANNER = False
 
+# Most codes accepted in a single bulk upload
+MAX_BATCH = 100_000
+# Requests served at once by production server, and how many of them may be
+# held open by event streams
+SERVER_THREADS = 16
+MAX_LISTENERS = 12
+# Seconds between attempts to reach controller for events, and milliseconds
+# browsers wait before reconnecting to event stream
+RELAY_RETRY = 2.0
+CLIENT_RETRY_MS = 3000
+# Seconds static files are cached for, and for a year if URL has a version
+STATIC_MAX_AGE = 24 * 60 * 60
+VERSIONED_MAX_AGE = 365 * 24 * 60 * 60
+# Seconds a status snapshot is shared between clients before it is rebuilt
+STATUS_TTL = 1.0
+
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.urandom(32)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = STATIC_MAX_AGE
 
 server_running = False
 
+_WHEEL_CHARACTERS = frozenset(CHARACTERS)
+
+# Latest status snapshot: status, JSON body, ETag and when it expires, with
+# whether one is being rebuilt and a count of times it was expired early
+_status: dict[str, Any] = {"expires": 0.0, "rebuilding": False, "expiries": 0}
+_status_lock = Lock()
+
+# Job progress from controller and web app, fanned out to event streams
+hub = events.Broadcaster()
+_listeners = BoundedSemaphore(MAX_LISTENERS)
+_relay: Optional[Thread] = None
+_relay_lock = Lock()
+
 
 def _ValidCharacters(form: FlaskForm, field: StringField) -> None:
     """
     Custom validator used for checking if code is in hexadecimal.
     """
-    # For each character in code
-    for character in field.data:  # type:ignore
-        # If character is not in characters:
-        if character.upper() not in Chassis.CHARACTERS:
-            # Raises error
-            raise ValidationError("Field must be in hexadecimal.")
+    # If any character is not in characters:
+    if not set(field.data.upper()) <= _WHEEL_CHARACTERS:  # type:ignore
+        # Raises error
+        raise ValidationError("Field must be in hexadecimal.")
+
+
+def validate_codes(codes: list) -> tuple[list[str], list[dict]]:
+    """
+    Validates batch of codes in a single pass. Returns normalized codes and
+    a list of errors, each with row number, code and message.
+    """
+    valid_codes: list[str] = []
+    errors: list[dict] = []
+    # Maps each code to row it first appeared on
+    first_rows: dict[str, int] = {}
+    for row, code in enumerate(codes, start=1):
+        # Checks type, length and characters
+        if not isinstance(code, str):
+            errors.append({"row": row, "code": code, "error": "Code must be text."})
+            continue
+        normalized = code.strip().upper()
+        if len(normalized) != CODE_LENGTH:
+            message = f"Code must be {CODE_LENGTH} characters."
+        elif not set(normalized) <= _WHEEL_CHARACTERS:
+            message = "Code must be in hexadecimal."
+        elif normalized in first_rows:
+            message = f"Duplicate of row {first_rows[normalized]}."
+        else:
+            first_rows[normalized] = row
+            valid_codes.append(normalized)
+            continue
+        errors.append({"row": row, "code": code, "error": message})
+    return valid_codes, errors
+
+
+def _read_upload() -> list:
+    """
+    Reads list of codes from request as JSON array or CSV. CSV may be sent as
+    a file field named "file" or as the request body, with codes in the first
+    column and an optional "code" header.
+    """
+    # Reads JSON array
+    if request.is_json:
+        codes = request.get_json(silent=True)
+        if not isinstance(codes, list):
+            raise ValueError("JSON body must be an array of codes.")
+        return codes
+    # Reads CSV from upload or body
+    upload = request.files.get("file")
+    text = (upload.read() if upload else request.get_data()).decode("utf-8-sig")
+    rows = [row for row in csv.reader(io.StringIO(text)) if row]
+    # Skips header row
+    if rows and rows[0][0].strip().lower() == "code":
+        rows = rows[1:]
+    return [row[0] for row in rows]
+
+
+def _controller_status() -> dict:
+    """
+    Asks motion controller for its status. Reports stamper as stopped if
+    controller is not running.
+    """
+    try:
+        return {"connected": True, **ipc.request("status")}
+    except (OSError, RuntimeError):
+        return {"connected": False, "running": False, "job": None}
+
+
+def _wake_controller(job_ids: list[int]) -> None:
+    """
+    Tells event stream listeners and motion controller that jobs were queued.
+    Controller finds them when it next starts if it is not running. Takes
+    IDs of queued jobs as parameter.
+    """
+    if job_ids:
+        hub.publish(
+            "queued", first=job_ids[0], last=job_ids[-1], pending=jobs.pending()
+        )
+    try:
+        ipc.request("wake")
+    except (OSError, RuntimeError):
+        print("Motion controller not reachable, jobs left queued")
+
+
+def _status_snapshot() -> tuple[dict, bytes, str]:
+    """
+    Returns controller status with number of queued jobs, as a dictionary,
+    as JSON, and an ETag that changes only when status does. Snapshot is
+    rebuilt at most once per status TTL however many clients ask, and
+    clients get the last one while it is rebuilt. Controller is asked
+    without holding the lock, so a slow reply holds up no other client.
+    """
+    with _status_lock:
+        now = time.monotonic()
+        cached = "body" in _status
+        if cached and (now < _status["expires"] or _status["rebuilding"]):
+            return _status["status"], _status["body"], _status["etag"]
+        _status["rebuilding"] = True
+        expiries = _status["expiries"]
+    try:
+        status = {**_controller_status(), "pending": jobs.pending()}
+    finally:
+        with _status_lock:
+            _status["rebuilding"] = False
+    body = json.dumps(status, sort_keys=True).encode()
+    etag = hashlib.sha1(body).hexdigest()[:16]
+    with _status_lock:
+        _status.update(
+            status=status,
+            body=body,
+            etag=etag,
+            # Snapshot asked for before an early expiry is already out of date
+            expires=now + STATUS_TTL if expiries == _status["expiries"] else 0.0,
+        )
+    return status, body, etag
+
+
+def _expire_status() -> None:
+    """
+    Makes next status request ask controller again.
+    """
+    with _status_lock:
+        _status["expires"] = 0.0
+        _status["expiries"] += 1
+
+
+@lru_cache(maxsize=None)
+def _static_version(filename: str) -> str:
+    """
+    Returns short hash of static file, so its URL changes when it does.
+    """
+    try:
+        with open(os.path.join(app.static_folder or "", filename), "rb") as file:
+            return hashlib.sha1(file.read()).hexdigest()[:8]
+    except OSError:
+        return ""
+
+
+@app.url_defaults
+def _version_static(endpoint: str, values: dict) -> None:
+    """
+    Adds version of file to static URLs.
+    """
+    if endpoint == "static" and "filename" in values:
+        values.setdefault("v", _static_version(values["filename"]))
+
+
+@app.after_request
+def _cache_static(response: Response) -> Response:
+    """
+    Lets browsers keep versioned static files for good, as a changed file
+    gets a new URL.
+    """
+    if request.endpoint == "static" and request.args.get("v"):
+        response.cache_control.public = True
+        response.cache_control.max_age = VERSIONED_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def _queue_eta(until_id: Optional[int] = None) -> Optional[float]:
+    """
+    Estimates seconds until every queued job, or job with specified ID, is
+    printed. Uses ETAs the controller timed from compiled plans when they
+    cover the jobs, and the estimates table otherwise. Returns None if
+    estimates have not been built yet.
+    """
+    active = jobs.active(until_id)
+    if not active:
+        return 0.0
+    try:
+        refined = ipc.request("eta")
+    except (OSError, RuntimeError):
+        refined = {"character": None, "ids": [], "seconds": []}
+    # Refined ETAs count from jobs since printed, which are left out
+    ids = [job.id for job in active]
+    first = refined["ids"].index(ids[0]) if ids[0] in refined["ids"] else None
+    if first is not None and refined["ids"][first : first + len(ids)] == ids:
+        seconds = refined["seconds"]
+        done = seconds[first - 1] if first else 0.0
+        return round(seconds[first + len(ids) - 1] - done, 1)
+    # Wheel starts from wherever controller left it
+    start = refined["character"] or STARTING_CHARACTER
+    # Imported on first use, as numpy is slow to import
+    import estimator
+
+    eta = estimator.queue_eta([job.code for job in active], start=start)
+    return None if eta is None else round(float(eta[-1]), 1)
 
 
 class CodeForm(FlaskForm):
@@ -66,7 +291,7 @@ class CodeForm(FlaskForm):
         "Code",
         validators=[
             DataRequired(),
-            Length(min=4, max=4),
+            Length(min=CODE_LENGTH, max=CODE_LENGTH),
             _ValidCharacters,
         ],
     )
@@ -81,8 +306,10 @@ def home():
     """
     form = CodeForm()
     # Gets states
-    stamper_running = get_cell(Cells.RUNNING)
+    status, _, _ = _status_snapshot()
+    stamper_running = status["running"]
     valid_submit = form.validate_on_submit()
+    job_id: Optional[int] = None
     # Reports states
     print(f"Running: {stamper_running}\nValid submit: {valid_submit}")
     # If valid code submission:
@@ -92,20 +319,227 @@ def home():
         # Reports
         print(f"Setting code to: {code}")
         flash(f"Code entered: {code}", "success")
-        # Sets spreadsheet code
-        set_cell(Cells.CODE, code)
+        # Queues code for stamper
+        (job_id,) = submit_codes([code])
+        _wake_controller([job_id])
+        eta = _queue_eta(job_id)
+        ready = "" if eta is None else f", ready in about {max(round(eta / 60), 1)} min"
+        flash(f"Queued as job #{job_id}, {jobs.position(job_id)} ahead{ready}.", "info")
     # If stamper is already running:
     elif stamper_running:
         # Reports
         print("Error flashing 'running'")
-        flash("Stamper already running!", "danger")
+        flash(f"Stamper running, {status['pending']} jobs queued.", "warning")
     # If invalid banner is activated:
     elif INVALID_BANNER:
         # Reports
         print("Error flashing 'entry error'")
         flash("Invalid code entered!", "danger")
-    # Returns html front page
-    return render_template("home.html", form=form)
+    # Returns html front page, following job just queued if any
+    return render_template("home.html", form=form, job_id=job_id)
+
+
+@app.route("/api/jobs", methods=["GET", "POST"])
+def api_jobs():
+    """
+    Bulk job endpoint. GET reports queue length and estimated seconds until
+    queue is printed. POST queues a JSON array or CSV of codes, all or
+    nothing, and reports per-row errors. Uploads with no codes are rejected.
+    Optional "sequence" query parameter reorders codes before queueing.
+    """
+    if request.method == "GET":
+        return jsonify(pending=jobs.pending(), eta_seconds=_queue_eta())
+    # Reads codes from request
+    try:
+        codes = _read_upload()
+    except (ValueError, UnicodeDecodeError) as error:
+        return jsonify(error=str(error)), 400
+    # Rejects uploads with no rows, such as an empty file
+    if not codes:
+        return jsonify(error="No codes found in upload."), 400
+    if len(codes) > MAX_BATCH:
+        return jsonify(error=f"At most {MAX_BATCH} codes per upload."), 413
+    # Rejects whole batch if any row is invalid
+    valid_codes, errors = validate_codes(codes)
+    if errors:
+        return jsonify(queued=0, errors=errors), 400
+    # Orders batch for least wheel travel and re-inking if asked
+    if request.args.get("sequence"):
+        from sequencer import sequence
+
+        valid_codes = [valid_codes[index] for index in sequence(valid_codes)]
+    job_ids = submit_codes(valid_codes)
+    _wake_controller(job_ids)
+    print(f"Queued {len(job_ids)} codes from upload")
+    return (
+        jsonify(
+            queued=len(job_ids),
+            first_id=job_ids[0] if job_ids else None,
+            last_id=job_ids[-1] if job_ids else None,
+            errors=[],
+        ),
+        201,
+    )
+
+
+@app.route("/api/status")
+def api_status() -> Response:
+    """
+    Reports whether stamper is running, current job and number of queued
+    jobs. Answers 304 Not Modified if client already has this status.
+    """
+    _, body, etag = _status_snapshot()
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Clients must check with server, but may reuse body if unchanged
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _relay_events() -> None:
+    """
+    Republishes controller's job progress to event stream listeners,
+    reconnecting whenever controller restarts. Only one relay runs, however
+    many listeners there are.
+    """
+    while True:
+        try:
+            for event in ipc.subscribe("events"):
+                if event is not None:
+                    hub.publish(event.pop("type"), connected=True, **event)
+        except (OSError, RuntimeError):
+            pass
+        if hub.state.get("connected", True):
+            hub.publish("disconnected", connected=False, activity="disconnected")
+        time.sleep(RELAY_RETRY)
+
+
+def _start_relay() -> None:
+    """
+    Starts relaying controller events if not already doing so.
+    """
+    global _relay
+    with _relay_lock:
+        if _relay is None:
+            _relay = Thread(target=_relay_events, daemon=True)
+            _relay.start()
+
+
+def _server_sent(kind: str, data: dict, number: int) -> str:
+    """
+    Formats event for an event stream.
+    """
+    return f"id: {number}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/events")
+def event_stream():
+    """
+    Streams job progress as Server-Sent Events: current state, then each
+    job queued, started, zeroing, inking or printing a character, done or
+    failed. Resumes after event in Last-Event-ID header if still held.
+    """
+    _start_relay()
+    # Each stream holds a server thread, so some are kept for other requests
+    if not _listeners.acquire(blocking=False):
+        return jsonify(error="Too many listeners, poll /api/status instead."), 503
+    after = request.headers.get("Last-Event-ID", type=int)
+
+    def stream() -> Iterator[str]:
+        try:
+            number, state = hub.snapshot()
+            yield f"retry: {CLIENT_RETRY_MS}\n\n"
+            yield _server_sent("status", state, number)
+            for item in hub.listen(number if after is None else after):
+                # Comment lines keep connection open through proxies
+                if item is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield _server_sent(item[1]["type"], item[1], item[0])
+        finally:
+            _listeners.release()
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/stop", methods=["POST"])
+@app.route("/api/cancel", methods=["POST"], defaults={"cancel": True})
+def api_stop(cancel: bool = False):
+    """
+    Halts motors at once. Stop holds stamper stopped and returns current job
+    to queue until resumed. Cancel only drops current job. Optional "reason"
+    in JSON body.
+    """
+    reason = (request.get_json(silent=True) or {}).get("reason")
+    try:
+        result = ipc.request("stop", reason=reason, cancel=cancel)
+    except (OSError, RuntimeError):
+        return jsonify(error="Motion controller is not running."), 503
+    # Listeners hear of stop from controller, status clients on next request
+    _expire_status()
+    if not result["stopped"]:
+        return jsonify(error="No job is being printed."), 409
+    return jsonify(result), 202
+
+
+@app.route("/api/resume", methods=["POST"])
+def api_resume():
+    """
+    Clears stop so queued jobs are printed again.
+    """
+    try:
+        ipc.request("resume")
+    except (OSError, RuntimeError):
+        return jsonify(error="Motion controller is not running."), 503
+    _expire_status()
+    return jsonify(stopped=False)
+
+
+@app.route("/api/jobs/<int:job_id>")
+def api_job(job_id: int):
+    """
+    Reports state of a job, jobs queued ahead of it and estimated seconds
+    until it is printed.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error=f"No job #{job_id}."), 404
+    waiting = job.state in (JobStates.QUEUED, JobStates.RUNNING)
+    return jsonify(
+        id=job.id,
+        code=job.code,
+        state=job.state,
+        ahead=jobs.position(job_id) if job.state == JobStates.QUEUED else 0,
+        eta_seconds=_queue_eta(job_id) if waiting else 0.0,
+        error=job.error,
+    )
+
+
+@app.route("/metrics")
+def metrics_page() -> Response:
+    """
+    Reports phase timings, half step lateness and jobs printed by motion
+    controller, and queue depth, in Prometheus text format. Nothing is
+    measured until scraped.
+    """
+    try:
+        result = ipc.request("metrics")
+        phases, jitter, running = result["phases"], result["jitter"], result["running"]
+        up = 1
+    except (OSError, RuntimeError):
+        phases, jitter, running, up = {}, None, False, 0
+    gauges = {
+        "controller_up": up,
+        "running": int(running),
+        "queue_depth": jobs.pending(),
+    }
+    return Response(
+        metrics.render(phases, gauges, jitter), mimetype="text/plain; version=0.0.4"
+    )
 
 
 @app.route("/about")
@@ -123,21 +557,33 @@ def shutdown() -> str:
     """
     # Reports
     print("Shutting down gracefully...")
-    # Shuts down server
-    os.kill(os.getpid(), signal.SIGINT)
+    # Shuts down supervisor and both processes if supervised, else server
+    os.kill(int(os.environ.get(SUPERVISOR_PID, os.getpid())), signal.SIGINT)
     return "Server shutting down..."
 
 
-def run_flask(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+def run_flask(
+    host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, development: bool = False
+) -> None:
     """
-    Runs webapp on specified host and port.
+    Runs webapp on specified host and port, with a production server and a
+    fixed number of worker threads. Optional parameter to run Flask's
+    development server instead.
     """
     global server_running
     # If server is not running:
     if not server_running:
-        # Starts server
-        app.run(host, port)
         server_running = True
+        if not development:
+            try:
+                from waitress import serve
+            except ImportError:
+                print("waitress not installed, using development server")
+            else:
+                # Starts server with bounded pool of worker threads
+                serve(app, host=host, port=port, threads=SERVER_THREADS)
+                return
+        app.run(host, port, threaded=True)
 
 
 def stop_flask() -> None:
@@ -147,10 +593,12 @@ def stop_flask() -> None:
     global server_running
     # If server is running:
     if server_running:
+        import requests
+
         # Posts to server for shutdown
         requests.post("http://127.0.0.1:5000/shutdown")
         server_running = False
 
 
 if __name__ == "__main__":
-    run_flask()
+    run_flask(development="--dev" in sys.argv)